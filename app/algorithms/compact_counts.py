@@ -0,0 +1,486 @@
+"""
+Compact exact counting for customer IDs.
+
+Instead of a Counter keyed by strings (one str object + dict entry per distinct
+customer), IDs are coded into integers and counted in NumPy arrays:
+  - Fixed-format IDs (letter prefix + zero-padded digits, e.g. "C000123") are
+    decoded to their numeric part with vectorized byte arithmetic: no
+    per-customer Python object is kept at all.
+  - Any other ID is interned once into a dict -> sequential code.
+Formats are learned as IDs arrive: once PROMOTE_AFTER distinct interned IDs
+share a (prefix, digit count), that format gets its own code space and the
+IDs already interned for it move there.
+
+Each code space is dense (arrays indexed by code) while its codes stay within
+DENSE_FACTOR times its distinct count, and sparse (append-only slots plus a
+sorted code index) otherwise, so memory follows the number of customers, not
+the largest numeric ID. Per customer we keep a count and the order in which it
+was first seen, so top-k (including tie order) is identical to top_k_exact.
+
+NumPy is imported on first use to keep API startup light.
+"""
+from __future__ import annotations
+import re
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+_FIXED_FORMAT = re.compile(r"([A-Za-z]+)([0-9]+)")
+MAX_FIXED_WIDTH = 18  # 10**18 < 2**63: wider numeric parts are interned
+DENSE_FACTOR = 4  # dense arrays may hold at most this many slots per distinct code...
+DENSE_SLACK = 1 << 16  # ...plus this many (768 KiB), so small counters never go sparse
+PROMOTE_AFTER = 32  # distinct interned IDs of one format before it gets a code space
+MAX_FORMATS = 8
+PROBE_BUDGET = 1 << 16  # new interned IDs checked for a format between promotions
+
+def _np():
+    import numpy
+    return numpy
+
+class _CodeSpace:
+    """
+    Count (int64) and first-seen rank (int32, -1 = unseen) per integer code.
+    Dense: arrays indexed by code. Sparse: arrays indexed by slot (append-only,
+    so slots never move) and `keys[slot] = code`, looked up through a few
+    sorted (codes, slots) runs that are merged as they grow.
+    """
+
+    def __init__(self, dense_slack: int = DENSE_SLACK):
+        np = _np()
+        self.dense_slack = dense_slack
+        self.dense = True
+        self.size = 0  # distinct codes counted
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.rank = np.zeros(0, dtype=np.int32)
+        self.keys = np.zeros(0, dtype=np.int64)  # sparse only
+        self._runs: List[Tuple["np.ndarray", "np.ndarray"]] = []  # sparse only, largest first
+        self._used = 0  # sparse only: slots handed out
+        self._max_code = -1  # sparse only
+
+    # -- storage --------------------------------------------------------
+    def _resize(self, size: int) -> None:
+        np = _np()
+        extra = size - len(self.counts)
+        if extra <= 0:
+            return
+        self.counts = np.concatenate([self.counts, np.zeros(extra, dtype=np.int64)])
+        self.rank = np.concatenate([self.rank, np.full(extra, -1, dtype=np.int32)])
+        if not self.dense:
+            self.keys = np.concatenate([self.keys, np.zeros(extra, dtype=np.int64)])
+
+    def _dense_limit(self, distinct: int) -> int:
+        return DENSE_FACTOR * distinct + self.dense_slack
+
+    def _to_sparse(self) -> None:
+        np = _np()
+        codes = np.flatnonzero(self.rank >= 0)
+        self.dense = False
+        self.keys, self.counts, self.rank = codes, self.counts[codes], self.rank[codes]
+        self._runs = [(codes, np.arange(len(codes), dtype=np.int64))] if len(codes) else []
+        self._used = len(codes)
+        self._max_code = int(codes[-1]) if len(codes) else -1
+
+    def _to_dense(self) -> None:
+        np = _np()
+        n = self._used
+        keys, counts, rank = self.keys[:n], self.counts[:n], self.rank[:n]
+        size = self._max_code + 1
+        self.dense = True
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.rank = np.full(size, -1, dtype=np.int32)
+        self.counts[keys], self.rank[keys] = counts, rank
+        self.keys, self._runs, self._used, self._max_code = np.zeros(0, dtype=np.int64), [], 0, -1
+
+    # -- sparse index ---------------------------------------------------
+    def _find(self, codes: "np.ndarray") -> "np.ndarray":
+        np = _np()
+        slots = np.full(len(codes), -1, dtype=np.int64)
+        for run_codes, run_slots in self._runs:
+            i = np.searchsorted(run_codes, codes)
+            i[i == len(run_codes)] = 0
+            hit = run_codes[i] == codes
+            slots[hit] = run_slots[i[hit]]
+        return slots
+
+    def _add_run(self, codes: "np.ndarray", slots: "np.ndarray") -> None:
+        np = _np()
+        self._runs.append((codes, slots))
+        # Binary-counter merging: O(log n) runs, each code re-sorted O(log n) times
+        while len(self._runs) > 1 and len(self._runs[-1][0]) >= len(self._runs[-2][0]) // 2:
+            (a_codes, a_slots), (b_codes, b_slots) = self._runs.pop(), self._runs.pop()
+            merged = np.concatenate([b_codes, a_codes])
+            order = np.argsort(merged, kind="stable")
+            self._runs.append((merged[order], np.concatenate([b_slots, a_slots])[order]))
+
+    # -- counting -------------------------------------------------------
+    def slots(self, codes: "np.ndarray") -> "np.ndarray":
+        """Storage slots for codes, creating unseen ones. Slots stay valid until the next call."""
+        np = _np()
+        if self.dense:
+            needed = int(codes.max()) + 1
+            if needed <= len(self.counts):
+                return codes
+            limit = self._dense_limit(self.size + len(codes))
+            if needed <= limit:
+                self._resize(min(max(needed, 2 * len(self.counts)), limit))
+                return codes
+            self._to_sparse()
+        elif self._max_code + 1 <= self._dense_limit(self._used) - self.dense_slack:
+            self._to_dense()  # codes filled in since going sparse: direct indexing is cheaper
+            return self.slots(codes)
+        found = self._find(codes)
+        missing = found < 0
+        if missing.any():
+            new = np.unique(codes[missing])
+            start = self._used
+            self._used += len(new)
+            if self._used > len(self.counts):
+                self._resize(max(self._used, 2 * len(self.counts)))
+            new_slots = np.arange(start, self._used, dtype=np.int64)
+            self.keys[new_slots] = new
+            self._max_code = max(self._max_code, int(new[-1]))
+            self._add_run(new, new_slots)
+            found[missing] = new_slots[np.searchsorted(new, codes[missing])]
+        return found
+
+    def add(
+        self, codes: "np.ndarray", pos: "np.ndarray", weights: Optional["np.ndarray"] = None
+    ) -> Tuple["np.ndarray", "np.ndarray"]:
+        """
+        codes[i] was seen at position pos[i] (row in the batch, or rank in a
+        merged counter) with weight weights[i] (1 if None). Returns the slots
+        seen for the first time, in order of first position, and that position;
+        the caller must then give them a rank with set_rank().
+        """
+        np = _np()
+        if len(codes) == 0:
+            return codes, pos
+        slots = self.slots(codes)
+        np.add.at(self.counts, slots, 1 if weights is None else weights)
+        new = self.rank[slots] < 0
+        if not new.any():
+            return slots[:0], pos[:0]
+        new_slots, new_pos = slots[new], pos[new].astype(np.int32)
+        # First position per new slot without sorting: scatter-min, then keep the winners
+        self.rank[new_slots] = np.iinfo(np.int32).max
+        np.minimum.at(self.rank, new_slots, new_pos)
+        first = self.rank[new_slots] == new_pos
+        self.size += int(first.sum())
+        return new_slots[first], new_pos[first]
+
+    def set_rank(self, slots: "np.ndarray", ranks: "np.ndarray") -> None:
+        self.rank[slots] = ranks
+
+    def absorb(self, codes: "np.ndarray", counts: "np.ndarray", ranks: "np.ndarray") -> None:
+        """Adds unseen codes with their counts and already assigned ranks."""
+        slots = self.slots(codes)
+        self.counts[slots] += counts
+        self.rank[slots] = ranks
+        self.size += len(codes)
+
+    def forget(self, slots: "np.ndarray") -> None:
+        self.counts[slots] = 0
+        self.rank[slots] = -1
+
+    # -- reading --------------------------------------------------------
+    def _codes(self, slots: "np.ndarray") -> "np.ndarray":
+        return slots if self.dense else self.keys[slots]
+
+    def seen(self) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+        """(codes, counts, ranks) of every code counted so far."""
+        np = _np()
+        slots = np.flatnonzero(self.rank >= 0)
+        return self._codes(slots), self.counts[slots], self.rank[slots]
+
+    def top_candidates(self, k: int) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+        """Codes whose count is >= the k-th largest in this space (ties included)."""
+        np = _np()
+        counts = self.counts
+        nonzero = int(np.count_nonzero(counts))
+        if nonzero == 0:
+            return (np.zeros(0, dtype=np.int64),) * 3
+        kth = 1
+        if nonzero > k:
+            kth = max(1, int(np.partition(counts, len(counts) - k)[len(counts) - k]))
+        slots = np.flatnonzero(counts >= kth)
+        return self._codes(slots), counts[slots], self.rank[slots]
+
+    @property
+    def nbytes(self) -> int:
+        return self.counts.nbytes + self.rank.nbytes + self.keys.nbytes + sum(c.nbytes + s.nbytes for c, s in self._runs)
+
+class _Format:
+    """A fixed ID format: `prefix` followed by exactly `width` digits."""
+
+    def __init__(self, prefix: str, width: int, dense_slack: int = DENSE_SLACK):
+        np = _np()
+        self.prefix, self.width = prefix, width
+        self.length = len(prefix) + width
+        self.prefix_cp = np.array([ord(ch) for ch in prefix], dtype=np.uint32)
+        self.powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+        self.space = _CodeSpace(dense_slack)
+
+    def matches(self, key: str) -> bool:
+        return len(key) == self.length and key.startswith(self.prefix) and key[len(self.prefix):].isdigit() \
+            and key[len(self.prefix):].isascii()
+
+    def decode(self, code: int) -> str:
+        return f"{self.prefix}{code:0{self.width}d}"
+
+_INTERNED = -1  # space id of interned keys
+
+class CompactCounter:
+    """
+    Exact counter over customer IDs. See the module docstring for the coding;
+    results never depend on which space an ID ended up in.
+    """
+
+    def __init__(self, dense_slack: int = DENSE_SLACK, formats: Sequence[Tuple[str, int]] = ()):
+        """
+        dense_slack: dense slots allowed beyond DENSE_FACTOR per customer; lower it for many small counters.
+        formats: (prefix, width) ID formats known up front, e.g. learned by a sibling counter.
+        """
+        self.dense_slack = dense_slack
+        self.formats: List[_Format] = [_Format(prefix, width, dense_slack) for prefix, width in formats[:MAX_FORMATS]]
+        self.interned = _CodeSpace(dense_slack)
+        self.intern_index: Dict[str, int] = {}
+        self.intern_keys: List[str] = []
+        self.distinct = 0  # next first-seen rank
+        self._format_votes: Counter = Counter()
+        self._probes_left = PROBE_BUDGET
+
+    def _space(self, space_id: int) -> _CodeSpace:
+        return self.interned if space_id == _INTERNED else self.formats[space_id].space
+
+    # -- coding ---------------------------------------------------------
+    def _fixed_codes(self, keys: Sequence[str]) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Vectorized decode: returns (format index per key or -1, code per key)."""
+        np = _np()
+        n = len(keys)
+        which = np.full(n, _INTERNED, dtype=np.int64)
+        codes = np.zeros(n, dtype=np.int64)
+        if not self.formats:
+            return which, codes
+        joined = "".join(keys)
+        try:
+            buf = np.frombuffer(joined.encode("ascii"), dtype=np.uint8)
+        except UnicodeEncodeError:
+            buf = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32)  # one code point per item
+        lengths = np.fromiter(map(len, keys), dtype=np.int64, count=n)
+        starts = None
+        for index, fmt in enumerate(self.formats):
+            rows = np.flatnonzero(lengths == fmt.length)
+            if len(rows) == 0:
+                continue
+            if len(rows) == n:
+                chars = buf.reshape(n, fmt.length)  # every key has this length: no gather needed
+            else:
+                if starts is None:
+                    starts = np.cumsum(lengths) - lengths
+                chars = buf[starts[rows, None] + np.arange(fmt.length)]
+            plen = len(fmt.prefix)
+            digits = chars[:, plen:].astype(np.int64) - 48
+            ok = (chars[:, :plen] == fmt.prefix_cp).all(axis=1) & ((digits >= 0) & (digits <= 9)).all(axis=1)
+            rows = rows[ok]
+            which[rows] = index
+            codes[rows] = digits[ok] @ fmt.powers
+        return which, codes
+
+    def _intern(self, keys: Sequence[str], rows: "np.ndarray") -> "np.ndarray":
+        np = _np()
+        index, names, votes = self.intern_index, self.intern_keys, self._format_votes
+        codes = np.empty(len(rows), dtype=np.int64)
+        for j, i in enumerate(rows.tolist()):
+            key = keys[i]
+            code = index.get(key)
+            if code is None:
+                code = index[key] = len(names)
+                names.append(key)
+                if self._probes_left > 0:
+                    self._probes_left -= 1
+                    m = _FIXED_FORMAT.fullmatch(key)
+                    if m is not None and len(m.group(2)) <= MAX_FIXED_WIDTH and m.group(2).isascii():
+                        votes[m.group(1), len(m.group(2))] += 1
+            codes[j] = code
+        return codes
+
+    def _classify(
+        self, keys: Sequence[str], pos: "np.ndarray", weights: Optional["np.ndarray"], groups: Dict[int, list]
+    ) -> None:
+        """Appends (codes, pos, weights) per space to groups."""
+        np = _np()
+        which, codes = self._fixed_codes(keys)
+        for index in range(len(self.formats)):
+            mask = which == index
+            if mask.any():
+                groups.setdefault(index, []).append((codes[mask], pos[mask], None if weights is None else weights[mask]))
+        rows = np.flatnonzero(which == _INTERNED)
+        if len(rows):
+            groups.setdefault(_INTERNED, []).append(
+                (self._intern(keys, rows), pos[rows], None if weights is None else weights[rows])
+            )
+
+    def _count(self, groups: Dict[int, list]) -> "np.ndarray":
+        """
+        Counts each space's group in a single add, then ranks the new codes by
+        first position. Returns those first positions in rank order.
+        """
+        np = _np()
+        new = []
+        for space_id, parts in groups.items():
+            codes = np.concatenate([p[0] for p in parts])
+            pos = np.concatenate([p[1] for p in parts])
+            weights = None if parts[0][2] is None else np.concatenate([p[2] for p in parts])
+            slots, first = self._space(space_id).add(codes, pos, weights)
+            if len(slots):
+                new.append((space_id, slots, first))
+        if not new:
+            return np.zeros(0, dtype=np.int64)
+        first = np.concatenate([f for _, _, f in new])
+        order = np.argsort(first, kind="stable")
+        ranks = np.empty(len(first), dtype=np.int32)
+        ranks[order] = np.arange(self.distinct, self.distinct + len(first), dtype=np.int32)
+        offset = 0
+        for space_id, slots, _ in new:
+            self._space(space_id).set_rank(slots, ranks[offset:offset + len(slots)])
+            offset += len(slots)
+        self.distinct += len(first)
+        return first[order]
+
+    def _promote_formats(self) -> None:
+        np = _np()
+        for (prefix, width), votes in list(self._format_votes.items()):
+            if votes < PROMOTE_AFTER or len(self.formats) >= MAX_FORMATS:
+                continue
+            del self._format_votes[prefix, width]
+            fmt = _Format(prefix, width, self.dense_slack)
+            self.formats.append(fmt)
+            self._probes_left = PROBE_BUDGET
+            # IDs interned before the format was known move to its space, keeping counts and ranks
+            moved = [(key, code) for key, code in self.intern_index.items() if fmt.matches(key)]
+            if not moved:
+                continue
+            old = np.array([code for _, code in moved], dtype=np.int64)
+            fmt.space.absorb(
+                np.array([int(key[len(prefix):]) for key, _ in moved], dtype=np.int64),
+                self.interned.counts[old], self.interned.rank[old],
+            )
+            self.interned.forget(old)
+            for key, code in moved:
+                del self.intern_index[key]
+                self.intern_keys[code] = ""
+
+    # -- public API -----------------------------------------------------
+    def update(self, keys: Sequence[str]) -> "np.ndarray":
+        """
+        Counts one batch of keys, in row order. Returns the positions in keys
+        where customers not seen before first appear, in rank order.
+        """
+        np = _np()
+        if len(keys) == 0:
+            return np.zeros(0, dtype=np.int64)
+        groups: Dict[int, list] = {}
+        self._classify(keys, np.arange(len(keys), dtype=np.int64), None, groups)
+        first = self._count(groups)
+        self._promote_formats()
+        return first
+
+    def _gather(self, parts: Sequence[Tuple["CompactCounter", Optional["np.ndarray"]]]) -> None:
+        """
+        Counts every part's customers in one step. parts[j] = (counter, at):
+        the customer of rank r in counter is placed at position at[r] (its rank
+        itself if at is None) when ranking customers new to this counter.
+        """
+        np = _np()
+        mine = {(f.prefix, f.width): i for i, f in enumerate(self.formats)}
+        groups: Dict[int, list] = {}
+        keys: List[str] = []
+        pos, weights = [], []
+        for other, at in parts:
+            for fmt in other.formats:
+                codes, counts, ranks = fmt.space.seen()
+                if not len(codes):
+                    continue
+                first = ranks.astype(np.int64) if at is None else at[ranks]
+                index = mine.get((fmt.prefix, fmt.width))
+                if index is not None:
+                    # Same format: codes carry over without building strings
+                    groups.setdefault(index, []).append((codes, first, counts))
+                else:
+                    keys += [fmt.decode(c) for c in codes.tolist()]
+                    pos.append(first)
+                    weights.append(counts)
+            codes, counts, ranks = other.interned.seen()
+            if len(codes):
+                keys += [other.intern_keys[c] for c in codes.tolist()]
+                pos.append(ranks.astype(np.int64) if at is None else at[ranks])
+                weights.append(counts)
+        if keys:
+            self._classify(keys, np.concatenate(pos), np.concatenate(weights), groups)
+        self._count(groups)
+        self._promote_formats()
+
+    def merge(self, other: "CompactCounter") -> None:
+        """
+        Adds another counter's counts, as if its input had been appended to this
+        one's: new customers rank after existing ones, in other's first-seen order.
+        """
+        self._gather([(other, None)])
+
+    @classmethod
+    def combine(
+        cls, parts: Sequence[Tuple["CompactCounter", Sequence[int]]], dense_slack: int = DENSE_SLACK
+    ) -> "CompactCounter":
+        """
+        Sums counters built over disjoint parts of one input into a new counter.
+        parts[j] = (counter, first_seen) where first_seen[r] is where that
+        counter's customer of rank r first appears in the whole input (e.g. a
+        row number), so first-seen order, and with it tie order, is the one of
+        the whole input whatever the order of parts.
+        """
+        np = _np()
+        total = cls(dense_slack, list(dict.fromkeys(f for other, _ in parts for f in other.format_keys())))
+        firsts = [np.asarray(first, dtype=np.int64) for _, first in parts]
+        if not firsts or not sum(len(f) for f in firsts):
+            return total
+        # Dense positions: first_seen may exceed the int32 ranks
+        _, dense = np.unique(np.concatenate(firsts), return_inverse=True)
+        bounds = np.cumsum([0] + [len(f) for f in firsts])
+        total._gather([(other, dense[bounds[j]:bounds[j + 1]]) for j, (other, _) in enumerate(parts)])
+        return total
+
+    def format_keys(self) -> List[Tuple[str, int]]:
+        """(prefix, width) of the learned ID formats, to seed other counters."""
+        return [(f.prefix, f.width) for f in self.formats]
+
+    def most_common(self, k: int) -> List[Tuple[str, int]]:
+        """Top-k by count; ties keep first-seen order (same as Counter + heapq.nlargest)."""
+        np = _np()
+        # Each space contributes its own top-k (plus ties), so the union holds the global top-k
+        parts = [(space_id, *self._space(space_id).top_candidates(k)) for space_id in [_INTERNED, *range(len(self.formats))]]
+        codes = np.concatenate([p[1] for p in parts])
+        counts = np.concatenate([p[2] for p in parts])
+        first = np.concatenate([p[3] for p in parts])
+        space_ids = np.concatenate([np.full(len(p[1]), p[0], dtype=np.int64) for p in parts])
+        order = np.lexsort((first, -counts))[:k]
+        return [(self._decode(int(space_ids[i]), int(codes[i])), int(counts[i])) for i in order]
+
+    def _decode(self, space_id: int, code: int) -> str:
+        if space_id == _INTERNED:
+            return self.intern_keys[code]
+        return self.formats[space_id].decode(code)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the count arrays (the intern dict is not included)."""
+        return self.interned.nbytes + sum(f.space.nbytes for f in self.formats)
+
+    @property
+    def total(self) -> int:
+        """Sum of all counts, i.e. the number of keys counted."""
+        return int(self.interned.counts.sum()) + sum(int(f.space.counts.sum()) for f in self.formats)
+
+    def __len__(self) -> int:
+        return self.distinct
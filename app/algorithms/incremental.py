@@ -0,0 +1,576 @@
+"""
+Incremental exact counting over append-only transaction files.
+
+For each file we keep CompactCounters per time bucket (BUCKET_SECONDS, by the
+transaction timestamp) and a cursor: raw bytes consumed, the incomplete
+trailing line and, for .gz, the live zlib decompressor (gzip appends are new
+members, which it follows across). When the file grows only the new tail is
+read and added to its buckets. Any window, fixed or rolling (`days`), is then
+answered from the buckets it covers entirely plus the rows of the (at most
+two) buckets it cuts, re-read from the file through a chunk index: one entry
+per READ_CHUNK read with the range of timestamps in it, so time-ordered files
+re-read about one bucket per edge. For .gz, decompressor states are saved at
+member starts and every GZ_CHECKPOINT_BYTES to restart from.
+A last line without a newline is counted on every query but never stored, so
+an append that completes it is not counted twice, and only once the file has
+been at rest for AT_REST_SECONDS: a writer may have cut it inside the last
+column, which still parses (`C0000` of `C000012`).
+
+The state is rebuilt from byte zero when the file was replaced (inode),
+truncated (size < offset), rewritten in place (same size, new mtime) or its
+head/last-processed bytes changed (checksums).
+
+State lives in memory of the current process (one cache per pool worker),
+bounded by entries and by an estimate of the bytes held. With only_growing,
+state is only built for files seen to change between two queries: sealed
+partitions are left to a plain scan, which is cheaper than a state that is
+never reused. With a state_dir, a refresh that read at least SHARE_MIN_BYTES is
+also saved there, and the other workers start from it instead of scanning the
+file again; the oldest state files are removed to keep the directory within
+the same byte budget.
+"""
+from __future__ import annotations
+import csv, hashlib, io, os, pickle, tempfile, time, zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+from app.algorithms.compact_counts import CompactCounter
+from app.algorithms.top_customers import ScanStats, Transaction
+
+if TYPE_CHECKING:
+    import numpy as np
+
+READ_CHUNK = 1 << 20
+CHECK_BYTES = 64 * 1024  # bytes hashed at the head and before the cursor
+BUCKET_SECONDS = 60 * 60
+BUCKET_DENSE_SLACK = 1024  # many small counters per file: keep their dense arrays tight
+GZ_CHECKPOINT_BYTES = 16 << 20  # compressed bytes between saved decompressor states (~40 KiB each)
+SHARE_MIN_BYTES = 8 << 20  # refreshes reading less are cheaper to repeat than to share
+AT_REST_SECONDS = 2  # unmodified for this long: the last line is complete even without a newline
+SEEN_ENTRIES = 4096  # files whose size/mtime at the last query is remembered (only_growing)
+BUDGET_CHECK_CHUNKS = 16  # chunks read between memory estimates while building
+KEY_BYTES = 64  # per interned ID beyond the count arrays (str object + dict slot)
+CHUNK_BYTES = 200  # per chunk index entry, its carried-over line apart
+GZ_STATE_BYTES = 40 << 10  # per saved zlib decompressor state
+_MEMBER_START = "member"  # checkpoint at a gzip member boundary: a new decompressor resumes there
+
+def _np():
+    import numpy
+    return numpy
+
+def _digest(path: Path, start: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return hashlib.blake2b(f.read(length), digest_size=16).digest()
+
+def _timestamps(batch: List[Transaction]) -> "np.ndarray":
+    return _np().fromiter((ts for ts, _, _ in batch), dtype=_np().int64, count=len(batch))
+
+def _new_inflater():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+def _inflate(decompressor, data: bytes) -> Tuple[object, bytes, bool]:
+    """Decompresses data, following into appended gzip members. Returns (decompressor, output, at member start)."""
+    out = []
+    fresh = False
+    while data:
+        out.append(decompressor.decompress(data))
+        if not decompressor.eof:
+            return decompressor, b"".join(out), False
+        # End of a gzip member: appended data starts a new one
+        data = decompressor.unused_data
+        decompressor, fresh = _new_inflater(), True
+    return decompressor, b"".join(out), fresh
+
+@dataclass
+class _Chunk:
+    """One READ_CHUNK read: enough to parse its complete lines again."""
+    raw_start: int
+    raw_end: int
+    pending: bytes  # incomplete line carried over from the previous read
+    row_start: int  # number of the first row parsed from it
+    skip: int = 0  # header bytes at the start of pending + data
+    min_timestamp: Optional[int] = None  # None: no rows
+    max_timestamp: Optional[int] = None
+    resume: Optional[object] = None  # .gz: decompressor state at raw_start, _MEMBER_START or None (no checkpoint)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if state["resume"] not in (None, _MEMBER_START):
+            state["resume"] = None  # zlib state cannot be pickled: restart from an earlier checkpoint
+        return state
+
+@dataclass
+class _Cursor:
+    path: Path
+    gz: bool
+    offset: int = 0
+    pending: bytes = b""
+    rows: int = 0  # complete rows parsed so far
+    chunks: List[_Chunk] = field(default_factory=list)
+    columns: Optional[Tuple[int, int, int]] = None
+    identity: Tuple[int, int] = (0, 0)
+    mtime_ns: int = 0
+    head_len: int = 0
+    head_digest: bytes = b""
+    tail_digest: bytes = b""
+    decompressor: Optional[object] = field(default=None, repr=False)
+    at_member_start: bool = True  # .gz: the decompressor has not consumed anything yet
+    _checkpoint_at: int = 0
+
+    def __post_init__(self):
+        if self.gz:
+            self.decompressor = _new_inflater()
+
+    def __getstate__(self):
+        if self.gz and not self.at_member_start:
+            raise pickle.PicklingError("gzip member still open")
+        state = dict(self.__dict__)
+        state["decompressor"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.gz:
+            self.decompressor = _new_inflater()
+
+    def status(self) -> str:
+        """'unchanged', 'append' or 'rebuild' compared to the file on disk."""
+        st = os.stat(self.path)
+        if (st.st_dev, st.st_ino) != self.identity or st.st_size < self.offset:
+            return "rebuild"
+        if st.st_size == self.offset:
+            return "unchanged" if st.st_mtime_ns == self.mtime_ns else "rebuild"
+        if _digest(self.path, 0, self.head_len) != self.head_digest:
+            return "rebuild"
+        tail_start = max(0, self.offset - CHECK_BYTES)
+        if _digest(self.path, tail_start, self.offset - tail_start) != self.tail_digest:
+            return "rebuild"
+        return "append"
+
+    def _parse(self, data: bytes) -> List[Transaction]:
+        i_ts, i_cid, i_amount = self.columns
+        rows = csv.reader(io.StringIO(data.decode("utf-8"), newline=""))
+        try:
+            return [(int(row[i_ts]), row[i_cid], int(row[i_amount])) for row in rows if row]
+        except (IndexError, csv.Error):
+            raise ValueError("Malformed CSV: a row has fewer columns than the header or bad quoting") from None
+
+    def _lines(self, chunk: _Chunk, data: bytes) -> List[Transaction]:
+        """Complete rows of a chunk, given its (decompressed) bytes."""
+        data = chunk.pending + data
+        return self._parse(data[chunk.skip:data.rfind(b"\n") + 1])
+
+    def _resume_point(self) -> Optional[object]:
+        if self.at_member_start:
+            self._checkpoint_at = self.offset
+            return _MEMBER_START
+        if self.offset - self._checkpoint_at >= GZ_CHECKPOINT_BYTES:
+            self._checkpoint_at = self.offset
+            return self.decompressor.copy()
+        return None
+
+    def at_rest(self) -> bool:
+        """True if the file was last modified at least AT_REST_SECONDS before now."""
+        return time.time_ns() - self.mtime_ns >= AT_REST_SECONDS * 10**9
+
+    def trailing_row(self) -> Optional[Transaction]:
+        """
+        The last line when the file does not end in a newline, parsed
+        provisionally: it is not part of the cursor, so an append that extends
+        the line replaces it. None if there is none, the file is still being
+        written (not at_rest) or the line does not parse.
+        """
+        if not self.pending or self.columns is None or not self.at_rest():
+            return None
+        try:
+            rows = self._parse(self.pending)
+        except (ValueError, UnicodeDecodeError):
+            return None  # cut mid-field or mid-character
+        return rows[0] if rows else None
+
+    def read_new(self, stats: ScanStats) -> Iterator[Tuple[_Chunk, List[Transaction], "np.ndarray"]]:
+        """Yields (chunk, rows, timestamps) for bytes appended since the last call (complete lines only)."""
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            while True:
+                t0 = time.perf_counter()
+                resume = self._resume_point() if self.gz else None
+                raw = f.read(READ_CHUNK)
+                if not raw:
+                    break
+                stats.bytes_read += len(raw)
+                chunk = _Chunk(self.offset, self.offset + len(raw), self.pending, self.rows, resume=resume)
+                self.offset += len(raw)
+                if self.gz:
+                    self.decompressor, data, self.at_member_start = _inflate(self.decompressor, raw)
+                else:
+                    data = raw
+                data = self.pending + data
+                if self.columns is None:
+                    chunk.skip = data.find(b"\n") + 1
+                    if chunk.skip:
+                        header = next(csv.reader([data[:chunk.skip].decode("utf-8")]))
+                        self.columns = tuple(header.index(c) for c in ("timestamp", "customer_id", "amount"))
+                cut = max(data.rfind(b"\n") + 1, chunk.skip)
+                self.pending = data[cut:]
+                batch = self._parse(data[chunk.skip:cut]) if self.columns is not None else []
+                timestamps = _timestamps(batch)
+                if batch:
+                    chunk.min_timestamp, chunk.max_timestamp = int(timestamps.min()), int(timestamps.max())
+                self.chunks.append(chunk)
+                self.rows += len(batch)
+                stats.add_phase("parse", time.perf_counter() - t0)
+                stats.rows_scanned += len(batch)
+                if batch:
+                    yield chunk, batch, timestamps
+        st = os.stat(self.path)
+        self.identity, self.mtime_ns = (st.st_dev, st.st_ino), st.st_mtime_ns
+        self.head_len = min(CHECK_BYTES, self.offset)
+        self.head_digest = _digest(self.path, 0, self.head_len)
+        tail_start = max(0, self.offset - CHECK_BYTES)
+        self.tail_digest = _digest(self.path, tail_start, self.offset - tail_start)
+
+    def reread(self, indices: List[int], stats: ScanStats) -> Iterator[Tuple[_Chunk, List[Transaction], "np.ndarray"]]:
+        """Yields (chunk, rows, timestamps) again for the given chunk indices, in increasing order (stats.rows_reread)."""
+        with open(self.path, "rb") as f:
+            decompressor, at = None, -1  # .gz: decompressor positioned at raw offset `at`
+            for i in indices:
+                t0 = time.perf_counter()
+                chunk = self.chunks[i]
+                if self.gz and at != chunk.raw_start:
+                    # Restart from the closest saved decompressor state before the chunk
+                    j = i
+                    while self.chunks[j].resume is None:
+                        j -= 1
+                    resume = self.chunks[j].resume
+                    decompressor = _new_inflater() if resume == _MEMBER_START else resume.copy()
+                    at = self.chunks[j].raw_start
+                    f.seek(at)
+                    while at < chunk.raw_start:
+                        raw = f.read(min(READ_CHUNK, chunk.raw_start - at))
+                        stats.bytes_read += len(raw)
+                        at += len(raw)
+                        decompressor, _, _ = _inflate(decompressor, raw)
+                f.seek(chunk.raw_start)
+                raw = f.read(chunk.raw_end - chunk.raw_start)
+                stats.bytes_read += len(raw)
+                if self.gz:
+                    decompressor, raw, _ = _inflate(decompressor, raw)
+                    at = chunk.raw_end
+                batch = self._lines(chunk, raw)
+                timestamps = _timestamps(batch)
+                stats.add_phase("parse", time.perf_counter() - t0)
+                stats.rows_reread += len(batch)
+                yield chunk, batch, timestamps
+
+@dataclass
+class _Bucket:
+    """Counts of one time bucket, and the row where each of its customers first appears."""
+    counter: CompactCounter
+    first_rows: List["np.ndarray"] = field(default_factory=list)  # by rank, one array per update
+
+    def add(self, keys: List[str], rows: "np.ndarray") -> None:
+        first = self.counter.update(keys)
+        if len(first):
+            self.first_rows.append(rows[first])
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate bytes held (interned IDs estimated at KEY_BYTES each)."""
+        counter = self.counter
+        return counter.nbytes + KEY_BYTES * len(counter.intern_keys) + sum(r.nbytes for r in self.first_rows)
+
+    def part(self) -> Tuple[CompactCounter, "np.ndarray"]:
+        np = _np()
+        if len(self.first_rows) > 1:
+            self.first_rows[:] = [np.concatenate(self.first_rows)]
+        return self.counter, (self.first_rows[0] if self.first_rows else np.zeros(0, dtype=np.int64))
+
+class _FileCounts:
+    """Per-bucket counts of one file and the cursor they are up to date with."""
+
+    def __init__(self, path: Path, bucket_seconds: int):
+        self.cursor = _Cursor(path, str(path).endswith(".gz"))
+        self.bucket_seconds = bucket_seconds
+        self.buckets: Dict[int, _Bucket] = {}
+        self.formats: List[Tuple[str, int]] = []  # ID formats learned so far, to seed new buckets
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate bytes held by the buckets and the chunk index."""
+        index = sum(
+            CHUNK_BYTES + len(c.pending) + (GZ_STATE_BYTES if c.resume not in (None, _MEMBER_START) else 0)
+            for c in self.cursor.chunks
+        )
+        return index + sum(b.nbytes for b in self.buckets.values())
+
+    def refresh(self, stats: ScanStats, max_bytes: Optional[int] = None) -> None:
+        """
+        Adds the rows appended since the last refresh to their buckets.
+        Raises _OverBudget (leaving the counts half-applied) once they hold more than max_bytes.
+        """
+        np = _np()
+        for n, (chunk, batch, ts) in enumerate(self.cursor.read_new(stats), 1):
+            if max_bytes is not None and n % BUDGET_CHECK_CHUNKS == 0 and self.nbytes > max_bytes:
+                raise _OverBudget(self.cursor.path)
+            t0 = time.perf_counter()
+            bucket_ids = ts // self.bucket_seconds
+            order = np.argsort(bucket_ids, kind="stable")  # file order inside each bucket
+            bucket_ids = bucket_ids[order]
+            keys = [batch[i][1] for i in order.tolist()]
+            rows = chunk.row_start + order
+            bounds = [0, *(np.flatnonzero(np.diff(bucket_ids)) + 1).tolist(), len(order)]
+            for lo, hi in zip(bounds, bounds[1:]):
+                bucket = self.buckets.get(int(bucket_ids[lo]))
+                if bucket is None:
+                    bucket = self.buckets[int(bucket_ids[lo])] = _Bucket(CompactCounter(BUCKET_DENSE_SLACK, self.formats))
+                bucket.add(keys[lo:hi], rows[lo:hi])
+                if len(bucket.counter.formats) != len(self.formats):
+                    self.formats = list(dict.fromkeys(self.formats + bucket.counter.format_keys()))
+            stats.add_phase("count", time.perf_counter() - t0)
+
+    def window(self, start_timestamp: int, end_timestamp: int, stats: ScanStats) -> CompactCounter:
+        """Exact counts for [start_timestamp, end_timestamp], first-seen order included."""
+        np = _np()
+        size = self.bucket_seconds
+        first_full, last_full = -(-start_timestamp // size), (end_timestamp + 1) // size - 1
+        parts = [self.buckets[b].part() for b in sorted(self.buckets) if first_full <= b <= last_full]
+        if first_full > last_full:
+            edges = [(start_timestamp, end_timestamp)]
+        else:
+            edges = [
+                (lo, hi) for lo, hi in ((start_timestamp, first_full * size - 1), ((last_full + 1) * size, end_timestamp))
+                if lo <= hi
+            ]
+        # Rows of the buckets the window cuts, from the chunks that can hold them
+        extra, extra_rows = CompactCounter(), []
+        chunks = [
+            i for i, c in enumerate(self.cursor.chunks)
+            if c.min_timestamp is not None and any(c.min_timestamp <= hi and c.max_timestamp >= lo for lo, hi in edges)
+        ]
+        for chunk, batch, ts in self.cursor.reread(chunks, stats):
+            t0 = time.perf_counter()
+            inside = np.zeros(len(batch), dtype=bool)
+            for lo, hi in edges:
+                inside |= (ts >= lo) & (ts <= hi)
+            hits = np.flatnonzero(inside)
+            first = extra.update([batch[i][1] for i in hits.tolist()])
+            extra_rows.append(chunk.row_start + hits[first])
+            stats.add_phase("filter", time.perf_counter() - t0)
+        row = self.cursor.trailing_row()
+        if row is not None:
+            stats.rows_reread += 1
+            if start_timestamp <= row[0] <= end_timestamp:
+                first = extra.update([row[1]])
+                extra_rows.append(np.full(len(first), self.cursor.rows, dtype=np.int64))
+        if len(extra):
+            parts.append((extra, np.concatenate(extra_rows)))
+        t0 = time.perf_counter()
+        counter = CompactCounter.combine(parts)
+        stats.add_phase("count", time.perf_counter() - t0)
+        return counter
+
+class _OverBudget(Exception):
+    """The counts of a file would hold more memory than the cache allows."""
+
+@dataclass
+class _Entry:
+    counts: _FileCounts
+    nbytes: int = 0  # counts plus the last query's counter, as of the last count()
+    lock: Lock = field(default_factory=Lock)
+    shared: Optional[Tuple[int, int]] = None  # (mtime_ns, size) of the state file last read or written
+    last: Optional[Tuple[int, int, int, bool, CompactCounter]] = None  # (start, end, offset, at rest, counter) of the last query
+
+class IncrementalCounts:
+    """
+    LRU cache of per-file bucketed exact counts. count() returns a counter
+    for the window that is up to date with the file, reading only what was
+    appended since the previous call for the same file (plus the window edges).
+
+    max_bytes bounds the estimated memory of all entries (least recently used
+    go first) and the state files in state_dir; a file whose counts alone
+    exceed it is not cached. only_growing: only files whose size or mtime
+    changed since the previous query are cached, others are skipped.
+    """
+
+    def __init__(
+        self, max_entries: int = 16, bucket_seconds: int = BUCKET_SECONDS, max_bytes: Optional[int] = None,
+        only_growing: bool = False,
+    ):
+        self.max_entries = max_entries
+        self.bucket_seconds = bucket_seconds
+        self.max_bytes = max_bytes
+        self.only_growing = only_growing
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # (device, inode), size, mtime_ns at the last query and whether the counts were over budget
+        self._seen: "OrderedDict[str, Tuple[Tuple[int, int], int, int, bool]]" = OrderedDict()
+        self._lock = Lock()
+
+    def _admit(self, key: str, path: Path, state_file: Optional[Path]) -> bool:
+        """Whether to start caching a file that has no entry, and remembers what it looks like now."""
+        st = os.stat(path)
+        now = ((st.st_dev, st.st_ino), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            previous = self._seen.pop(key, None)
+            same_file = previous is not None and previous[0] == now[0]
+            too_big = same_file and previous[3]
+            self._seen[key] = (*now, too_big)
+            while len(self._seen) > SEEN_ENTRIES:
+                self._seen.popitem(last=False)
+        if too_big:
+            return False
+        if not self.only_growing:
+            return True
+        if state_file is not None and state_file.exists():
+            return True  # another process already saw it grow
+        return same_file and previous[1:3] != now[1:]
+
+    def _drop(self, key: str, entry: _Entry, too_big: bool) -> None:
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+            if too_big and key in self._seen:
+                self._seen[key] = (*self._seen[key][:3], True)
+
+    def _fit(self, key: str, entry: _Entry) -> None:
+        """Evicts least recently used entries until the cache is within max_bytes."""
+        last = entry.last[4].nbytes if entry.last is not None else 0
+        entry.nbytes = entry.counts.nbytes + last
+        if self.max_bytes is None:
+            return
+        if entry.nbytes > self.max_bytes:
+            self._drop(key, entry, too_big=True)
+            return
+        with self._lock:
+            total = sum(e.nbytes for e in self._entries.values())
+            for other in list(self._entries):
+                if total <= self.max_bytes:
+                    break
+                if other != key:
+                    total -= self._entries.pop(other).nbytes
+
+    def _entry(self, key: str, path: Path) -> Tuple[_Entry, bool]:
+        with self._lock:
+            entry = self._entries.get(key)
+            created = entry is None
+            if created:
+                entry = _Entry(_FileCounts(path, self.bucket_seconds))
+                self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry, created
+
+    def _load_shared(self, entry: _Entry, state_file: Path) -> bool:
+        """Adopts the state another process saved, if it is newer than ours."""
+        try:
+            st = os.stat(state_file)
+        except FileNotFoundError:
+            return False
+        if (st.st_mtime_ns, st.st_size) == entry.shared:
+            return False
+        entry.shared = (st.st_mtime_ns, st.st_size)
+        with open(state_file, "rb") as f:
+            counts = pickle.load(f)
+        if counts.bucket_seconds != self.bucket_seconds or counts.cursor.offset <= entry.counts.cursor.offset:
+            return False
+        counts.cursor.path = entry.counts.cursor.path
+        entry.counts, entry.last = counts, None
+        return True
+
+    def _save_shared(self, entry: _Entry, state_file: Path) -> None:
+        try:
+            data = pickle.dumps(entry.counts, protocol=pickle.HIGHEST_PROTOCOL)
+        except pickle.PicklingError:
+            return  # .gz cut inside a member: stays private to this process
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            return
+        fd, tmp = tempfile.mkstemp(dir=state_file.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, state_file)
+        st = os.stat(state_file)
+        entry.shared = (st.st_mtime_ns, st.st_size)
+        if self.max_bytes is not None:
+            self._prune_shared(state_file)
+
+    def _prune_shared(self, keep: Path) -> None:
+        """Removes the oldest state files until the directory is within max_bytes."""
+        files = []
+        for state_file in keep.parent.glob("*.state"):
+            try:
+                st = os.stat(state_file)
+            except FileNotFoundError:
+                continue  # removed by another process
+            files.append((st.st_mtime_ns, st.st_size, state_file))
+        total = sum(size for _, size, _ in files)
+        for _, size, state_file in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if state_file != keep:
+                state_file.unlink(missing_ok=True)
+                total -= size
+
+    def count(
+        self, path: Path, start_timestamp: int, end_timestamp: int, stats: Optional[ScanStats] = None,
+        state_dir: Optional[str] = None,
+    ) -> Tuple[Optional[CompactCounter], str]:
+        """
+        Returns (counter, outcome) with outcome in miss | shared | unchanged | append | rebuild
+        (shared: started from the state another process saved in state_dir), or
+        (None, skipped | over_budget) for a file that is not cached: the caller scans it.
+        The counter must not be modified. In stats, rows_scanned are the rows
+        appended since the last refresh, rows_reread the window edges and
+        rows_in_window the counter's total.
+        """
+        stats = stats if stats is not None else ScanStats()
+        key = str(Path(path).resolve())
+        state_file = None
+        if state_dir is not None:
+            state_file = Path(state_dir) / (hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest() + ".state")
+        with self._lock:
+            cached = key in self._entries
+        if not cached and not self._admit(key, Path(path), state_file):
+            return None, "skipped"
+        entry, created = self._entry(key, Path(path))
+        with entry.lock:
+            shared = state_file is not None and self._load_shared(entry, state_file)
+            fresh = created and not shared
+            outcome = "miss" if fresh else entry.counts.cursor.status()
+            if outcome == "rebuild":
+                entry.counts, entry.last = _FileCounts(Path(path), self.bucket_seconds), None
+            if shared and outcome != "rebuild":
+                outcome = "shared"
+            before = stats.bytes_read
+            if outcome != "unchanged":
+                try:
+                    entry.counts.refresh(stats, self.max_bytes)
+                except _OverBudget:
+                    entry.counts, entry.last = _FileCounts(Path(path), self.bucket_seconds), None
+                    self._drop(key, entry, too_big=True)
+                    return None, "over_budget"
+                except BaseException:
+                    # Half-applied tail: start over on the next call
+                    entry.counts, entry.last = _FileCounts(Path(path), self.bucket_seconds), None
+                    raise
+                if state_file is not None and stats.bytes_read - before >= SHARE_MIN_BYTES:
+                    self._save_shared(entry, state_file)
+            cursor = entry.counts.cursor
+            query = (start_timestamp, end_timestamp, cursor.offset, bool(cursor.pending) and cursor.at_rest())
+            if entry.last is not None and entry.last[:4] == query:
+                counter = entry.last[4]
+            else:
+                counter = entry.counts.window(start_timestamp, end_timestamp, stats)
+                entry.last = (*query, counter)
+            self._fit(key, entry)
+            stats.rows_in_window += counter.total
+            return counter, outcome
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._seen.clear()
@@ -0,0 +1,103 @@
+"""
+Date-partitioned transaction datasets.
+
+A dataset can be a single file, a directory or a glob. Each partition's time
+range comes from a `_manifest.json` in the directory (for a glob: in its
+literal root and next to the matched files), if present:
+
+    {"partitions": [{"path": "2025-01-03.csv.gz", "min_timestamp": 1735862400, "max_timestamp": 1735948799}]}
+
+otherwise from a date in its path relative to the directory or the glob's
+literal root (`transactions-2025-01-03.csv.gz`, `20250103.csv`,
+`dt=2025-01-03/part-0.csv.gz`), taken as that whole UTC day.
+Partitions with no known range are never pruned.
+"""
+from __future__ import annotations
+import glob, json, re
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+MANIFEST_NAME = "_manifest.json"
+DATA_SUFFIXES = (".csv", ".csv.gz")
+SECONDS_PER_DAY = 24 * 60 * 60
+_DATE_IN_NAME = re.compile(r"(?<!\d)(\d{4})-?(\d{2})-?(\d{2})(?!\d)")
+
+@dataclass(frozen=True)
+class Partition:
+    path: Path
+    min_timestamp: Optional[int] = None  # inclusive; None = unknown
+    max_timestamp: Optional[int] = None  # inclusive; None = unknown
+
+    def overlaps(self, start_timestamp: int, end_timestamp: int) -> bool:
+        if self.min_timestamp is not None and self.min_timestamp > end_timestamp:
+            return False
+        if self.max_timestamp is not None and self.max_timestamp < start_timestamp:
+            return False
+        return True
+
+def _is_data_file(path: Path) -> bool:
+    return path.is_file() and str(path).endswith(DATA_SUFFIXES)
+
+def _range_from_name(relative: str) -> Tuple[Optional[int], Optional[int]]:
+    # The last date in the path wins (closest to the file name)
+    for year, month, day in reversed(_DATE_IN_NAME.findall(relative)):
+        try:
+            day_start = datetime(int(year), int(month), int(day), tzinfo=timezone.utc)
+        except ValueError:
+            continue  # digits that only look like a date
+        start = int(day_start.timestamp())
+        return start, start + SECONDS_PER_DAY - 1
+    return None, None
+
+def _load_manifest(root: Path) -> dict:
+    manifest = root / MANIFEST_NAME
+    if not manifest.exists():
+        return {}
+    entries = json.loads(manifest.read_text(encoding="utf-8")).get("partitions", [])
+    return {(root / e["path"]).resolve(): e for e in entries}
+
+def _glob_root(pattern: str) -> Path:
+    # Leading components without glob magic: `data/dt=*/*.csv` -> `data`
+    parts = Path(pattern).parts
+    for i, part in enumerate(parts):
+        if glob.has_magic(part):
+            return Path(*parts[:i]) if i else Path(".")
+    return Path(pattern).parent
+
+def _partition(path: Path, root: Optional[Path], manifest: dict) -> Partition:
+    entry = manifest.get(path.resolve())
+    if entry is not None:
+        return Partition(path, entry.get("min_timestamp"), entry.get("max_timestamp"))
+    relative = str(path.relative_to(root)) if root is not None else path.name
+    return Partition(path, *_range_from_name(relative))
+
+def discover_partitions(location: str) -> List[Partition]:
+    """
+    Resolves a file, directory (searched recursively) or glob into partitions,
+    ordered by start of range (unknown first) and then path.
+    Raises FileNotFoundError when nothing matches.
+    """
+    path = Path(location)
+    if path.is_file():
+        return [Partition(path)]  # single file: always scanned, as before
+    if path.is_dir():
+        manifest = _load_manifest(path)
+        partitions = [_partition(p, path, manifest) for p in path.rglob("*") if _is_data_file(p)]
+    elif glob.has_magic(location):
+        root = _glob_root(location)
+        matches = [Path(p) for p in glob.glob(location, recursive=True) if _is_data_file(Path(p))]
+        manifest = _load_manifest(root)
+        for directory in sorted({p.parent for p in matches}):
+            manifest.update(_load_manifest(directory))
+        partitions = [_partition(p, root, manifest) for p in matches]
+    else:
+        partitions = []
+    if not partitions:
+        raise FileNotFoundError(location)
+    return sorted(partitions, key=lambda p: (p.min_timestamp if p.min_timestamp is not None else -1, str(p.path)))
+
+def prune_partitions(partitions: List[Partition], start_timestamp: int, end_timestamp: int) -> List[Partition]:
+    """Keeps the partitions whose range can overlap [start_timestamp, end_timestamp]."""
+    return [p for p in partitions if p.overlaps(start_timestamp, end_timestamp)]
@@ -0,0 +1,110 @@
+"""
+Disk spill of customer IDs for single-pass streaming.
+
+When the input can only be read once (generator, stdin, upload body), the
+verification pass of Misra–Gries cannot go back to the source. Instead, the
+in-window IDs are appended to a temporary file as runs (customer_id, length)
+of consecutive equal IDs, and verification reads that file.
+
+File layout: a sequence of blocks, one per write(), each
+    <u32 compressed size> zlib(<u32 runs> <u32 id bytes> <u32 lengths[runs]> <u32 counts[runs]> <id bytes>)
+Memory stays at one block at a time in both directions.
+"""
+from __future__ import annotations
+import struct, tempfile, zlib
+from array import array
+from itertools import accumulate
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+_SIZE = struct.Struct("<I")
+_HEADER = struct.Struct("<II")
+COMPRESS_LEVEL = 1  # the spill is read once right after: favour speed
+
+class RunSpill:
+    """
+    Append-only, run-length-encoded spill of customer IDs in a temporary file
+    (deleted on close). A run left open at the end of one write() continues
+    into the next, so splitting the input into batches does not add records.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self._last: Optional[str] = None
+        self._last_count = 0
+        self.ids = 0  # IDs written
+        self.runs = 0  # records written
+        self.bytes_written = 0
+
+    def write(self, ids: Sequence[str]) -> None:
+        if not ids:
+            return
+        keys: List[str] = []
+        counts: List[int] = []
+        last, n = self._last, self._last_count
+        for cid in ids:
+            if cid == last:
+                n += 1
+            else:
+                if n:
+                    keys.append(last)
+                    counts.append(n)
+                last, n = cid, 1
+        self._last, self._last_count = last, n
+        self.ids += len(ids)
+        self._write_block(keys, counts)
+
+    def _write_block(self, keys: List[str], counts: List[int]) -> None:
+        if not keys:
+            return
+        encoded = [k.encode("utf-8") for k in keys]
+        blob = b"".join(encoded)
+        payload = b"".join((
+            _HEADER.pack(len(keys), len(blob)),
+            array("I", map(len, encoded)).tobytes(),
+            array("I", counts).tobytes(),
+            blob,
+        ))
+        block = zlib.compress(payload, COMPRESS_LEVEL)
+        self._file.write(_SIZE.pack(len(block)))
+        self._file.write(block)
+        self.runs += len(keys)
+        self.bytes_written += _SIZE.size + len(block)
+
+    def flush(self) -> None:
+        """Closes the open run; call once all IDs were written."""
+        if self._last_count:
+            self._write_block([self._last], [self._last_count])
+            self._last, self._last_count = None, 0
+
+    def blocks(self) -> Iterator[Tuple[List[bytes], array]]:
+        """
+        Yields (ids as UTF-8 bytes, run lengths) per block, from the start.
+        IDs stay as bytes so the caller can match them without decoding each one.
+        """
+        self.flush()
+        self._file.flush()
+        self._file.seek(0)
+        while True:
+            size = self._file.read(_SIZE.size)
+            if not size:
+                return
+            payload = zlib.decompress(self._file.read(_SIZE.unpack(size)[0]))
+            n, _ = _HEADER.unpack_from(payload)
+            offset = _HEADER.size
+            lengths = array("I")
+            lengths.frombytes(payload[offset:offset + n * 4])
+            counts = array("I")
+            counts.frombytes(payload[offset + n * 4:offset + n * 8])
+            blob = payload[offset + n * 8:]
+            ends = list(accumulate(lengths))
+            yield [blob[e - l:e] for e, l in zip(ends, lengths)], counts
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "RunSpill":
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self.close()
+        return False
@@ -1,12 +1,49 @@
 from __future__ import annotations
-import csv, gzip, heapq
+import csv, gzip, heapq, io, time
 from collections import Counter
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
 from pathlib import Path
-from typing import Dict, Iterable, Iterator, List, Tuple
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from app.algorithms.compact_counts import CompactCounter
+from app.algorithms.spill import RunSpill
 
 Transaction = Tuple[int, str, int]  # (timestamp, customer_id, amount)
 
+BATCH_SIZE = 8192  # rows per batch for the instrumented (batched) scan
+
+# ---------------------------
+# Scan statistics
+# ---------------------------
+@dataclass
+class ScanStats:
+    """
+    Counters and per-phase timings collected during a scan.
+    Phases: parse (decompress + CSV parse), filter (time window), count, select (top-k)
+    and, in single-pass stream mode, spill (writing candidate runs to disk).
+    rows_reread: rows parsed again from a file already counted (incremental window edges).
+    """
+    rows_scanned: int = 0
+    rows_in_window: int = 0
+    rows_reread: int = 0
+    bytes_read: int = 0
+    spill_bytes: int = 0
+    phase_seconds: Dict[str, float] = field(default_factory=dict)
+
+    def add_phase(self, phase: str, seconds: float) -> None:
+        self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+
+    def merge(self, other: "ScanStats") -> None:
+        """Adds another scan's stats (phase times add up across concurrent partitions)."""
+        self.rows_scanned += other.rows_scanned
+        self.rows_in_window += other.rows_in_window
+        self.rows_reread += other.rows_reread
+        self.bytes_read += other.bytes_read
+        self.spill_bytes += other.spill_bytes
+        for phase, seconds in other.phase_seconds.items():
+            self.add_phase(phase, seconds)
+
 # ---------------------------
 # CSV reading utilities
 # ---------------------------
@@ -21,6 +58,91 @@ def iter_csv_transactions(path: Path) -> Iterator[Transaction]:
         for row in r:
             yield (int(row["timestamp"]), row["customer_id"], int(row["amount"]))
 
+def iter_csv_batches(
+    path: Path, stats: Optional[ScanStats] = None, batch_size: int = BATCH_SIZE
+) -> Iterator[List[Transaction]]:
+    """
+    Same rows as iter_csv_transactions, grouped in lists of batch_size.
+    Raises ValueError if a required column is missing from the header or a row
+    is malformed (short row, non-integer timestamp/amount, bad quoting).
+    Timing is taken per batch (not per row) so instrumentation stays off the hot loop.
+    bytes_read is measured on the raw file, i.e. compressed bytes for .gz.
+    """
+    with open(path, "rb") as raw:
+        binary = gzip.GzipFile(fileobj=raw) if str(path).endswith(".gz") else raw
+        yield from _iter_batches(binary, raw.tell, stats, batch_size)
+
+class _CountingReader(io.RawIOBase):
+    """Raw reader over any binary stream that counts the bytes taken from it (pipes have no tell())."""
+
+    def __init__(self, stream: BinaryIO):
+        self._stream = stream
+        self.consumed = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        data = self._stream.read(len(b))
+        n = len(data)
+        b[:n] = data
+        self.consumed += n
+        return n
+
+def iter_csv_stream_batches(
+    stream: BinaryIO, stats: Optional[ScanStats] = None, batch_size: int = BATCH_SIZE
+) -> Iterator[List[Transaction]]:
+    """
+    iter_csv_batches over an open binary stream that is read once, front to back
+    (upload body, stdin, pipe). Gzip is detected from the magic bytes.
+    bytes_read counts the bytes taken from the stream.
+    """
+    counting = _CountingReader(stream)
+    buffered = io.BufferedReader(counting)
+    binary = gzip.GzipFile(fileobj=buffered) if buffered.peek(2)[:2] == b"\x1f\x8b" else buffered
+    yield from _iter_batches(binary, lambda: counting.consumed, stats, batch_size)
+
+def _iter_batches(
+    binary: BinaryIO, consumed: Callable[[], int], stats: Optional[ScanStats], batch_size: int
+) -> Iterator[List[Transaction]]:
+    with io.TextIOWrapper(binary, encoding="utf-8", newline="") as f:
+        r = csv.reader(f)
+        # Positional access (csv.reader) avoids building a dict per row
+        header = next(r, None)
+        if not header:
+            return
+        i_ts, i_cid, i_amount = (header.index(c) for c in ("timestamp", "customer_id", "amount"))
+        rows = filter(None, r)  # skip blank lines like DictReader
+        offset = 0
+        while True:
+            t0 = time.perf_counter()
+            try:
+                batch = [
+                    (int(row[i_ts]), row[i_cid], int(row[i_amount]))
+                    for _, row in zip(range(batch_size), rows)
+                ]
+            except IndexError:
+                raise ValueError(f"Malformed CSV: line {r.line_num} has fewer columns than the header") from None
+            except csv.Error as e:
+                raise ValueError(f"Malformed CSV: line {r.line_num}: {e}") from None
+            if stats is not None:
+                stats.add_phase("parse", time.perf_counter() - t0)
+                stats.rows_scanned += len(batch)
+                position = consumed()
+                stats.bytes_read += position - offset
+                offset = position
+            if not batch:
+                return
+            yield batch
+
+def _batched(rows: Iterable[Transaction], batch_size: int = BATCH_SIZE) -> Iterator[List[Transaction]]:
+    it = iter(rows)
+    while True:
+        batch = list(islice(it, batch_size))
+        if not batch:
+            return
+        yield batch
+
 # ---------------------------
 # Mode 1: EXACT (memory)
 # ---------------------------
@@ -34,6 +156,31 @@ def top_k_exact(
     # O(m log k) with nlargest (m = unique customers)
     return heapq.nlargest(k, c.items(), key=lambda x: x[1])
 
+def top_k_exact_compact(
+    batches: Iterable[List[Transaction]], start_timestamp: int, end_timestamp: int, k: int = 10,
+    stats: Optional[ScanStats] = None,
+) -> List[Tuple[str, int]]:
+    """
+    Same result as top_k_exact, counting into integer-coded NumPy arrays
+    (CompactCounter) instead of a string-keyed Counter: several times less
+    memory per distinct customer, and counting is vectorized per batch.
+    """
+    stats = stats if stats is not None else ScanStats()
+    c = CompactCounter()
+    for batch in batches:
+        t0 = time.perf_counter()
+        in_window = [cid for ts, cid, _ in batch if start_timestamp <= ts <= end_timestamp]
+        t1 = time.perf_counter()
+        c.update(in_window)
+        t2 = time.perf_counter()
+        stats.add_phase("filter", t1 - t0)
+        stats.add_phase("count", t2 - t1)
+        stats.rows_in_window += len(in_window)
+    t0 = time.perf_counter()
+    result = c.most_common(k)
+    stats.add_phase("select", time.perf_counter() - t0)
+    return result
+
 # ---------------------------
 # Mode 2: STREAMING (Misra–Gries + verification)
 # ---------------------------
@@ -61,6 +208,18 @@ class MG:
             for k in to_del:
                 del self.counters[k]
 
+    def merge(self, other: "MG") -> None:
+        """
+        Mergeable Misra–Gries: add counters, then subtract the (capacity+1)-th
+        largest value and drop non-positive ones. Keeps the same error bound
+        as a single summary over the concatenated input.
+        """
+        for k, v in other.counters.items():
+            self.counters[k] = self.counters.get(k, 0) + v
+        if len(self.counters) > self.capacity:
+            cut = heapq.nlargest(self.capacity + 1, self.counters.values())[-1]
+            self.counters = {k: v - cut for k, v in self.counters.items() if v > cut}
+
 def top_k_streaming_two_pass(
     rows: Iterable[Transaction],
     start_timestamp: int,
@@ -68,6 +227,12 @@ def top_k_streaming_two_pass(
     top_customers: int = 10,
     capacity: int = 200,  # bounded memory (adjustable)
 ) -> List[Tuple[str, int]]:
+    """
+    rows is iterated twice. One-shot iterators (generators, readers) cannot be
+    replayed, so they are routed to top_k_stream_single_pass instead.
+    """
+    if iter(rows) is rows:
+        return top_k_stream_single_pass(_batched(rows), start_timestamp, end_timestamp, top_customers, capacity)
     # 1) Pass 1: candidates with Misra–Gries
     mg = MG(capacity=capacity)
     for ts, cid, _ in rows:
@@ -77,29 +242,165 @@ def top_k_streaming_two_pass(
     candidates = set(mg.counters.keys())
     # 2) Pass 2: exact count ONLY of candidates
     counts: Dict[str, int] = {c: 0 for c in candidates}
-    # rows puede ser generador de 1 sola pasada; documenta que para archivo se itera 2 veces
-    if hasattr(rows, "__iter__") and not hasattr(rows, "__next__"):
-        iterable = rows  # podría ser lista
-    # For security, we require new reading if it was a generator
-    # (in CLI we will read twice from file)
     for ts, cid, _ in rows:
         if start_timestamp <= ts <= end_timestamp and cid in counts:
             counts[cid] += 1
 
     return heapq.nlargest(top_customers, counts.items(), key=lambda x: x[1])
 
-# Helper for file in 2 passes
-def top_k_from_file_two_pass(path: Path, start_timestamp: int, end_timestamp: int, top_customers: int = 10, capacity: int = 200):
-    # pass 1
+def top_k_stream_single_pass(
+    batches: Iterable[List[Transaction]], start_timestamp: int, end_timestamp: int, top_customers: int = 10,
+    capacity: int = 200, stats: Optional[ScanStats] = None, spill_dir: Optional[str] = None,
+) -> List[Tuple[str, int]]:
+    """
+    Misra–Gries for inputs that can only be read once. While candidates are
+    selected, in-window IDs are spilled to a temporary file as run-length-encoded
+    runs (RunSpill); the verification pass reads the spill, not the source.
+    Memory: O(capacity + batch); disk: one compressed record per run.
+    """
+    stats = stats if stats is not None else ScanStats()
     mg = MG(capacity=capacity)
-    for ts, cid, _ in iter_csv_transactions(path):
-        if start_timestamp <= ts <= end_timestamp:
+    with RunSpill(spill_dir) as spill:
+        for batch in batches:
+            t0 = time.perf_counter()
+            in_window = [cid for ts, cid, _ in batch if start_timestamp <= ts <= end_timestamp]
+            t1 = time.perf_counter()
+            for cid in in_window:
+                mg.offer(cid)
+            t2 = time.perf_counter()
+            spill.write(in_window)
+            stats.add_phase("filter", t1 - t0)
+            stats.add_phase("count", t2 - t1)
+            stats.add_phase("spill", time.perf_counter() - t2)
+            stats.rows_in_window += len(in_window)
+
+        # Verification over the spill, matching IDs as UTF-8 bytes
+        t0 = time.perf_counter()
+        counts: Dict[str, int] = {c: 0 for c in mg.counters}
+        by_bytes = {c.encode("utf-8"): c for c in mg.counters}
+        for ids, runs in spill.blocks():
+            for key, n in zip(ids, runs):
+                cid = by_bytes.get(key)
+                if cid is not None:
+                    counts[cid] += n
+        stats.spill_bytes += spill.bytes_written
+        stats.add_phase("count", time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    result = heapq.nlargest(top_customers, counts.items(), key=lambda x: x[1])
+    stats.add_phase("select", time.perf_counter() - t0)
+    return result
+
+# ---------------------------
+# Partitioned inputs (several files, read concurrently)
+# ---------------------------
+def _map_partitions(func, paths: List[Path], max_workers: int):
+    """Applies func to every path, concurrently when there is more than one; results keep path order."""
+    if len(paths) <= 1 or max_workers <= 1:
+        return [func(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as pool:
+        return list(pool.map(func, paths))
+
+def _count_partition_compact(path: Path, start_timestamp: int, end_timestamp: int) -> Tuple[CompactCounter, ScanStats]:
+    stats = ScanStats()
+    c = CompactCounter()
+    for batch in iter_csv_batches(path, stats):
+        t0 = time.perf_counter()
+        in_window = [cid for ts, cid, _ in batch if start_timestamp <= ts <= end_timestamp]
+        t1 = time.perf_counter()
+        c.update(in_window)
+        stats.add_phase("filter", t1 - t0)
+        stats.add_phase("count", time.perf_counter() - t1)
+        stats.rows_in_window += len(in_window)
+    return c, stats
+
+PartitionCounter = Callable[[Path, int, int], Optional[Tuple[CompactCounter, ScanStats]]]
+
+def top_k_exact_partitions(
+    paths: List[Path], start_timestamp: int, end_timestamp: int, k: int = 10,
+    stats: Optional[ScanStats] = None, max_workers: int = 4,
+    count_partition: Optional[PartitionCounter] = None,
+) -> List[Tuple[str, int]]:
+    """
+    Exact top-k over several files: each partition is counted into its own
+    CompactCounter concurrently, then merged in path order. Same result as
+    top_k_exact over the files concatenated in that order.
+    count_partition replaces the full scan of a partition (e.g. with cached
+    incremental counts); returned counters are not modified. Partitions it
+    returns None for are scanned in full.
+    """
+    stats = stats if stats is not None else ScanStats()
+
+    def count(path: Path) -> Tuple[CompactCounter, ScanStats]:
+        counted = count_partition(path, start_timestamp, end_timestamp) if count_partition else None
+        return counted if counted is not None else _count_partition_compact(path, start_timestamp, end_timestamp)
+
+    partials = _map_partitions(count, paths, max_workers)
+    t0 = time.perf_counter()
+    total = partials[0][0] if len(partials) == 1 else CompactCounter()
+    for c, partial_stats in partials:
+        if c is not total:
+            total.merge(c)
+        stats.merge(partial_stats)
+    stats.add_phase("count", time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    result = total.most_common(k)
+    stats.add_phase("select", time.perf_counter() - t0)
+    return result
+
+def _mg_partition(path: Path, start_timestamp: int, end_timestamp: int, capacity: int) -> Tuple[MG, ScanStats]:
+    stats = ScanStats()
+    mg = MG(capacity=capacity)
+    for batch in iter_csv_batches(path, stats):
+        t0 = time.perf_counter()
+        in_window = [cid for ts, cid, _ in batch if start_timestamp <= ts <= end_timestamp]
+        t1 = time.perf_counter()
+        for cid in in_window:
             mg.offer(cid)
-    candidates = set(mg.counters.keys())
+        stats.add_phase("filter", t1 - t0)
+        stats.add_phase("count", time.perf_counter() - t1)
+        stats.rows_in_window += len(in_window)
+    return mg, stats
 
-    # pass 2
-    counts: Dict[str, int] = {c: 0 for c in candidates}
-    for ts, cid, _ in iter_csv_transactions(path):
-        if start_timestamp <= ts <= end_timestamp and cid in counts:
-            counts[cid] += 1
-    return heapq.nlargest(top_customers, counts.items(), key=lambda x: x[1])
+def _verify_partition(path: Path, start_timestamp: int, end_timestamp: int, candidates: frozenset) -> Tuple[Dict[str, int], ScanStats]:
+    stats = ScanStats()
+    counts: Dict[str, int] = {}
+    for batch in iter_csv_batches(path, stats):
+        t0 = time.perf_counter()
+        in_window = [cid for ts, cid, _ in batch if start_timestamp <= ts <= end_timestamp and cid in candidates]
+        t1 = time.perf_counter()
+        for cid in in_window:
+            counts[cid] = counts.get(cid, 0) + 1
+        stats.add_phase("filter", t1 - t0)
+        stats.add_phase("count", time.perf_counter() - t1)
+    return counts, stats
+
+def top_k_stream_partitions(
+    paths: List[Path], start_timestamp: int, end_timestamp: int, top_customers: int = 10, capacity: int = 200,
+    stats: Optional[ScanStats] = None, max_workers: int = 4,
+) -> List[Tuple[str, int]]:
+    """
+    Two-pass Misra–Gries over several files: per-partition summaries are built
+    concurrently and merged (mergeable MG), then candidates are verified per
+    partition and their exact counts summed.
+    """
+    stats = stats if stats is not None else ScanStats()
+    mg = MG(capacity=capacity)
+    for partial, partial_stats in _map_partitions(
+        lambda p: _mg_partition(p, start_timestamp, end_timestamp, capacity), paths, max_workers
+    ):
+        mg.merge(partial)
+        stats.merge(partial_stats)
+    candidates = frozenset(mg.counters)
+
+    counts: Dict[str, int] = {c: 0 for c in mg.counters}
+    for partial, partial_stats in _map_partitions(
+        lambda p: _verify_partition(p, start_timestamp, end_timestamp, candidates), paths, max_workers
+    ):
+        for cid, n in partial.items():
+            counts[cid] += n
+        partial_stats.rows_in_window = 0  # already accounted in pass 1
+        stats.merge(partial_stats)
+    t0 = time.perf_counter()
+    result = heapq.nlargest(top_customers, counts.items(), key=lambda x: x[1])
+    stats.add_phase("select", time.perf_counter() - t0)
+    return result
@@ -1,9 +1,14 @@
-from fastapi import APIRouter, HTTPException, status
+import zlib
+from gzip import BadGzipFile
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from app.core.executor import run_heavy, run_heavy_stream
 from app.schemas.order import OrderRequest, OrderResponse
 from app.services.pricing import compute_order_total
 
 from app.schemas.analytics import TopCustomersRequest, TopCustomersResponse
-from app.services.analytics import top_customers_service
+from app.services.analytics import top_customers_service, top_customers_upload_service
 
 from app.schemas.dataset import DatasetGenRequest, DatasetGenResponse
 from app.services.dataset import generate_transactions_dataset
@@ -26,13 +31,53 @@ from app.services.transit import (
 
 router = APIRouter(tags=["orders", "analytics"])
 
+# Bodies taken as a raw transactions upload (CSV or CSV.GZ); anything else is JSON
+UPLOAD_CONTENT_TYPES = ("text/csv", "application/gzip", "application/x-gzip", "application/octet-stream")
+
+TOP_CUSTOMERS_OPENAPI = {"requestBody": {"required": True, "content": {
+    "application/json": {"schema": TopCustomersRequest.model_json_schema()},
+    **{ct: {"schema": {"type": "string", "format": "binary"}} for ct in UPLOAD_CONTENT_TYPES},
+}}}
+
+def _validation_error(e: ValidationError, location: str) -> RequestValidationError:
+    return RequestValidationError([{**err, "loc": (location, *err["loc"])} for err in e.errors(include_url=False)])
+
+def _upload_params(request: Request) -> TopCustomersRequest:
+    params = dict(request.query_params)
+    if "days" not in params and ("start" in params or "end" in params):
+        params["days"] = None  # an explicit window replaces the default `days`
+    try:
+        return TopCustomersRequest.model_validate(params)
+    except ValidationError as e:
+        raise _validation_error(e, "query")
+
 
 # 1. Data algorithms and structures
 # 1.1. Question 1: Complexity and optimization
-@router.post("/analytics/top-customers", response_model=TopCustomersResponse)
-def top_customers(payload: TopCustomersRequest):
+@router.post("/analytics/top-customers", response_model=TopCustomersResponse, openapi_extra=TOP_CUSTOMERS_OPENAPI)
+async def top_customers(request: Request):
+    """
+    JSON body: `TopCustomersRequest` over a dataset on disk (`path`).
+
+    CSV / CSV.GZ body (`Content-Type: text/csv`, `application/gzip` or
+    `application/octet-stream`): the upload is streamed to a worker and read
+    once. Window and options go in the query string, e.g.
+    `?start=2025-01-01T00:00:00Z&end=2025-01-31T23:59:59Z&top_customers=10`.
+    """
+    content_type = request.headers.get("content-type", "").partition(";")[0].strip().lower()
+    if content_type in UPLOAD_CONTENT_TYPES:
+        params = _upload_params(request)
+        try:
+            return await run_heavy_stream("top_customers", top_customers_upload_service, request.stream(), params)
+        except (ValueError, EOFError, BadGzipFile, zlib.error) as e:  # malformed upload
+            raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        payload = TopCustomersRequest.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise _validation_error(e, "body")
     try:
-        return top_customers_service(payload)
+        return await run_heavy("top_customers", top_customers_service, payload)
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Archivo de datos no encontrado")
     except ValueError as e:
@@ -40,9 +85,9 @@ def top_customers(payload: TopCustomersRequest):
 
 # 1.1.1. Generate transactions dataset
 @router.post("/datasets/transactions/generate", response_model=DatasetGenResponse)
-def dataset_generate(payload: DatasetGenRequest):
+async def dataset_generate(payload: DatasetGenRequest):
     try:
-        return generate_transactions_dataset(payload)
+        return await run_heavy("dataset_generate", generate_transactions_dataset, payload)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -9,6 +10,28 @@ class Settings(BaseSettings):
     discount_threshold: int = 100_000
     discount_rate: float = 0.05
 
+    # profiling bajo demanda (apagado por defecto)
+    profiling_enabled: bool = False
+    profiling_interval: float = 0.005  # segundos entre muestras
+    profiling_max_seconds: int = 60
+
+    # ejecución de endpoints pesados (pool de procesos + control de admisión)
+    heavy_pool_workers: int = 2
+    top_customers_max_concurrency: int = 2
+    top_customers_max_queue: int = 8
+    dataset_generate_max_concurrency: int = 1
+    dataset_generate_max_queue: int = 2
+    admission_queue_timeout: float = 30.0  # segundos en cola antes de responder 503
+    admission_retry_after: int = 5  # valor del header Retry-After
+    partition_read_workers: int = 4  # particiones leídas en paralelo por consulta
+    incremental_enabled: bool = True  # modo exacto: solo lee lo agregado desde la última consulta
+    incremental_cache_entries: int = 16  # archivos recordados por proceso
+    incremental_cache_bytes: int = 256 << 20  # memoria estimada del estado por proceso, y disco de INCREMENTAL_STATE_DIR
+    incremental_bucket_seconds: int = 3600  # conteos por archivo agrupados por hora de la transacción
+    incremental_state_dir: Optional[str] = None  # estado compartido entre workers (None = directorio privado del pool)
+    stream_spill_dir: Optional[str] = None  # modo stream de una pasada: directorio temporal (None = el del sistema)
+    prewarm_on_startup: bool = True  # arranca los workers (Faker, analítica) en el startup
+
     class Config:
         env_file = ".env"
 
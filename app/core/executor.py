@@ -0,0 +1,342 @@
+"""
+Execution layer for CPU-heavy endpoints.
+
+Heavy work (top-customers scans, dataset generation) runs in a dedicated,
+size-bounded process pool instead of the shared request threadpool, so it
+neither starves light endpoints nor serializes on the GIL. Each endpoint has
+its own admission limiter (max concurrency + bounded queue); excess requests
+are rejected fast with a retry hint instead of piling up. A shared limiter
+sized to the pool sits behind them, since the endpoint limits may add up to
+more workers than there are.
+
+Inputs that can only be read once (request bodies) are streamed to the worker
+through a pipe as they arrive (run_heavy_stream), never buffered whole.
+"""
+from __future__ import annotations
+import asyncio, importlib, io, os, select, shutil, socket, tempfile
+from collections import deque
+from threading import Lock
+from typing import TYPE_CHECKING, Any, AsyncIterable, Callable, Deque, Dict, Optional, Tuple
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.profiling import current_profile, run_sampled, sample_listeners, serve_sampling
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing.connection import Connection
+
+# Modules every worker imports up front, so the first heavy request does not pay for them
+WARM_MODULES: Tuple[str, ...] = ("numpy", "app.services.analytics", "app.services.dataset")
+# Pipe messages never exceed PIPE_BUF (4-byte length header included): such writes are
+# atomic, so a non-blocking send either goes through whole or not at all.
+PIPE_MESSAGE_BYTES = select.PIPE_BUF - 4
+STREAM_BUFFER_BYTES = 64 * 1024
+
+# ---------------------------
+# Admission control
+# ---------------------------
+class Overloaded(Exception):
+    """Raised when a heavy request cannot be admitted. Mapped to 429 (queue full) or 503."""
+
+    def __init__(self, endpoint: str, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.endpoint = endpoint
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+class AdmissionLimiter:
+    """
+    Async concurrency limiter with a bounded FIFO queue.
+    Must be used from the event loop (single-threaded), so no locking is needed.
+    """
+
+    def __init__(self, endpoint: str, max_concurrency: int, max_queue: int, queue_timeout: float, retry_after: int):
+        self.endpoint = endpoint
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> None:
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            metrics.ADMISSION_ACTIVE.set(self.endpoint, value=self.active)
+            return
+        if len(self._waiters) >= self.max_queue:
+            metrics.ADMISSION_REJECTED.inc(self.endpoint, "queue_full")
+            raise Overloaded(self.endpoint, 429, self.retry_after, "Too many concurrent requests, retry later")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        metrics.ADMISSION_QUEUED.set(self.endpoint, value=len(self._waiters))
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.ADMISSION_REJECTED.inc(self.endpoint, "queue_timeout")
+            raise Overloaded(self.endpoint, 503, self.retry_after, "Timed out waiting for an execution slot")
+        except BaseException:
+            # Cancelled after the slot was handed over: give it back
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            metrics.ADMISSION_QUEUED.set(self.endpoint, value=len(self._waiters))
+
+    def release(self) -> None:
+        # Hand the slot directly to the oldest live waiter (active count unchanged)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+        metrics.ADMISSION_ACTIVE.set(self.endpoint, value=self.active)
+
+    async def __aenter__(self) -> "AdmissionLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> bool:
+        self.release()
+        return False
+
+_limiters: Dict[str, AdmissionLimiter] = {}
+HEAVY_ENDPOINTS: Tuple[str, ...] = ("top_customers", "dataset_generate")
+POOL_LIMITER = "heavy_pool"
+
+def get_limiter(endpoint: str) -> AdmissionLimiter:
+    """Limiter for an endpoint, configured from settings.<endpoint>_max_concurrency / _max_queue."""
+    limiter = _limiters.get(endpoint)
+    if limiter is None:
+        limiter = AdmissionLimiter(
+            endpoint,
+            max_concurrency=getattr(settings, f"{endpoint}_max_concurrency"),
+            max_queue=getattr(settings, f"{endpoint}_max_queue"),
+            queue_timeout=settings.admission_queue_timeout,
+            retry_after=settings.admission_retry_after,
+        )
+        _limiters[endpoint] = limiter
+    return limiter
+
+def get_pool_limiter() -> AdmissionLimiter:
+    """
+    Limiter shared by every heavy endpoint, with one slot per pool worker.
+    Without it, requests admitted beyond HEAVY_POOL_WORKERS would wait in the
+    executor's unbounded internal queue with no timeout; here they wait at most
+    ADMISSION_QUEUE_TIMEOUT (then 503), like in the endpoint queues.
+    """
+    limiter = _limiters.get(POOL_LIMITER)
+    if limiter is None:
+        limiter = AdmissionLimiter(
+            POOL_LIMITER,
+            max_concurrency=settings.heavy_pool_workers,
+            # Only requests already admitted by an endpoint get here
+            max_queue=sum(getattr(settings, f"{e}_max_concurrency") for e in HEAVY_ENDPOINTS),
+            queue_timeout=settings.admission_queue_timeout,
+            retry_after=settings.admission_retry_after,
+        )
+        _limiters[POOL_LIMITER] = limiter
+    return limiter
+
+# ---------------------------
+# Process pool
+# ---------------------------
+# multiprocessing / concurrent.futures.process are imported on first use:
+# light-only processes (and test runs that never hit a heavy endpoint) skip them.
+_pool: Optional["ProcessPoolExecutor"] = None
+_pool_lock = Lock()
+_control_dir: Optional[str] = None  # where workers' sampling listeners bind (see sample_pool)
+_state_dir: Optional[str] = None  # created for the pool when INCREMENTAL_STATE_DIR is unset
+
+def _mp_context():
+    import multiprocessing
+    # forkserver children fork from a clean, single-threaded server process,
+    # avoiding locks inherited mid-acquire from the web process.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def _init_worker(control_dir: Optional[str] = None, state_dir: Optional[str] = None) -> None:
+    """
+    Pool initializer: loads the heavy subsystems once per worker process and
+    starts its sampling listener, so /debug/profile can see work running here.
+    state_dir is where workers share incremental top-customer counts.
+    """
+    if control_dir is not None:
+        serve_sampling(control_dir)
+    if state_dir is not None:
+        settings.incremental_state_dir = state_dir
+    for module in WARM_MODULES:
+        importlib.import_module(module)
+    from app.services.dataset import get_faker
+    get_faker("es_CO")
+
+def _ping() -> bool:
+    return True
+
+def get_pool() -> "ProcessPoolExecutor":
+    global _pool, _control_dir, _state_dir
+    with _pool_lock:
+        if _pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            # Private (0700) directories; AF_UNIX is missing on some platforms: no live sampling there
+            _control_dir = tempfile.mkdtemp(prefix="heavy-pool-") if hasattr(socket, "AF_UNIX") else None
+            if settings.incremental_state_dir is None:
+                _state_dir = tempfile.mkdtemp(prefix="heavy-state-")
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.heavy_pool_workers, mp_context=_mp_context(),
+                initializer=_init_worker, initargs=(_control_dir, settings.incremental_state_dir or _state_dir),
+            )
+        return _pool
+
+def prewarm() -> None:
+    """
+    Explicit prewarm step: starts every pool worker and waits until each has
+    run _init_worker. One task per worker is enough, since the pool spawns a
+    new process for each submit while none is idle.
+    """
+    pool = get_pool()
+    for future in [pool.submit(_ping) for _ in range(settings.heavy_pool_workers)]:
+        future.result()
+
+def shutdown_pool(wait: bool = True) -> None:
+    global _pool, _control_dir, _state_dir
+    with _pool_lock:
+        pool, _pool = _pool, None
+        control_dir, _control_dir = _control_dir, None
+        state_dir, _state_dir = _state_dir, None
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=True)
+    for directory in (control_dir, state_dir):
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def sample_pool(seconds: float, interval: Optional[float] = None) -> Dict[int, str]:
+    """
+    Samples every live pool worker for `seconds`, concurrently, including those
+    busy with a request. Returns collapsed stacks by worker pid ({} if no pool).
+    """
+    control_dir = _control_dir
+    return sample_listeners(control_dir, seconds, interval) if control_dir is not None else {}
+
+def _run_in_worker(func: Callable[..., Any], args: Tuple[Any, ...], profile_interval: Optional[float]):
+    """
+    Worker-side entry point: runs func (optionally sampled) and ships back the
+    metric deltas recorded in this process so /metrics in the parent stays complete.
+    """
+    if profile_interval is None:
+        result, stacks = func(*args), None
+    else:
+        result, stacks = run_sampled(func, *args, interval=profile_interval)
+    return result, stacks, metrics.REGISTRY.drain()
+
+class _PipeStream(io.RawIOBase):
+    """Worker side of run_heavy_stream: the chunks received on the pipe as a binary stream (b"" ends it)."""
+
+    def __init__(self, conn: "Connection"):
+        self._conn = conn
+        self._chunk = b""
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._chunk and not self._eof:
+            try:
+                self._chunk = self._conn.recv_bytes()
+            except EOFError:
+                # Sender went away without the end marker (e.g. client disconnected)
+                raise ValueError("Upload ended before it was complete") from None
+            self._eof = not self._chunk
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+def _run_stream_in_worker(func: Callable[..., Any], conn: "Connection", args: Tuple[Any, ...], profile_interval: Optional[float]):
+    with conn, io.BufferedReader(_PipeStream(conn), STREAM_BUFFER_BYTES) as stream:
+        return _run_in_worker(func, (stream, *args), profile_interval)
+
+async def _submit(endpoint: str, entry: Callable[..., Any], *entry_args: Any) -> Any:
+    profile = current_profile()
+    interval = settings.profiling_interval if profile is not None else None
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    from concurrent.futures.process import BrokenProcessPool
+    try:
+        async with get_pool_limiter():
+            result, stacks, drained = await loop.run_in_executor(pool, entry, *entry_args, interval)
+    except BrokenProcessPool:
+        shutdown_pool(wait=False)
+        metrics.ADMISSION_REJECTED.inc(endpoint, "pool_broken")
+        raise Overloaded(endpoint, 503, settings.admission_retry_after, "Worker pool restarted, retry later")
+    metrics.REGISTRY.merge(drained)
+    if profile is not None:
+        profile.stacks = stacks
+    return result
+
+async def run_heavy(endpoint: str, func: Callable[..., Any], *args: Any) -> Any:
+    """
+    Runs func(*args) in the heavy process pool under the endpoint's admission limiter.
+    func and args must be picklable. Request profiling is honoured inside the worker.
+    """
+    async with get_limiter(endpoint):
+        return await _submit(endpoint, _run_in_worker, func, args)
+
+async def _wait_writable(conn: "Connection", task: "asyncio.Future") -> None:
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    loop.add_writer(conn.fileno(), lambda: ready.done() or ready.set_result(None))
+    try:
+        await asyncio.wait({ready, task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        loop.remove_writer(conn.fileno())
+
+async def _feed(conn: "Connection", chunks: AsyncIterable[bytes], task: "asyncio.Future") -> None:
+    """
+    Sends chunks to the worker without blocking the event loop; a full pipe
+    applies back-pressure to the client. Stops early once the worker is done
+    (it may fail or finish before reading everything).
+    """
+    async def send(message: bytes) -> bool:
+        while not task.done():
+            try:
+                conn.send_bytes(message)
+                return True
+            except BlockingIOError:
+                await _wait_writable(conn, task)
+            except BrokenPipeError:
+                return False
+        return False
+
+    async for chunk in chunks:
+        for i in range(0, len(chunk), PIPE_MESSAGE_BYTES):
+            if not await send(chunk[i:i + PIPE_MESSAGE_BYTES]):
+                return
+    await send(b"")
+
+async def run_heavy_stream(endpoint: str, func: Callable[..., Any], chunks: AsyncIterable[bytes], *args: Any) -> Any:
+    """
+    Like run_heavy, for an input that can only be read once: func(stream, *args)
+    runs in the pool, with `stream` a binary file fed with `chunks` as they arrive.
+    Memory in both processes is bounded by the pipe and read buffers.
+    """
+    async with get_limiter(endpoint):
+        reader, writer = _mp_context().Pipe(duplex=False)
+        os.set_blocking(writer.fileno(), False)
+        task = asyncio.ensure_future(_submit(endpoint, _run_stream_in_worker, func, reader, args))
+        try:
+            await _feed(writer, chunks, task)
+        finally:
+            writer.close()  # without the end marker the worker sees EOF and gives up
+            try:
+                await asyncio.wait({task})  # the worker holds `reader` until it is done
+            finally:
+                reader.close()
+        return task.result()
@@ -0,0 +1,370 @@
+"""
+In-process metrics registry with Prometheus text exposition.
+
+Kept dependency-free on purpose: counters, gauges and histograms are plain
+dicts guarded by a lock, so an observation costs a dict lookup plus a bisect.
+"""
+from __future__ import annotations
+import time
+from bisect import bisect_left
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+from starlette.routing import Match
+
+LabelValues = Tuple[str, ...]
+
+# Default latency buckets (seconds): sub-millisecond up to long analytics scans
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+# ---------------------------
+# Metric types
+# ---------------------------
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_float(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+
+    def _key(self, labels: LabelValues) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(v) for v in labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def drain(self):
+        """Returns and clears the accumulated values (used to ship deltas out of worker processes)."""
+        return {}
+
+    def merge(self, values) -> None:
+        pass
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_float(v)}" for k, v in items]
+
+    def drain(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values: Dict[LabelValues, float]) -> None:
+        with self._lock:
+            for key, amount in values.items():
+                self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_float(v)}" for k, v in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        # key -> (per-bucket counts (non cumulative, last slot = +Inf), sum)
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, *labels: str, value: float) -> None:
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[key] = entry
+            entry[0][idx] += 1
+            entry[1][0] += value
+
+    def count(self, *labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return sum(entry[0]) if entry else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(c), s[0])) for k, (c, s) in self._values.items())
+        lines: List[str] = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                cumulative += n
+                le = _format_labels(self.labelnames, key, ("le", _format_float(bound)))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            plain = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{plain} {_format_float(total)}")
+            lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+    def drain(self) -> Dict[LabelValues, Tuple[List[int], List[float]]]:
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values: Dict[LabelValues, Tuple[List[int], List[float]]]) -> None:
+        with self._lock:
+            for key, (counts, total) in values.items():
+                entry = self._values.get(key)
+                if entry is None:
+                    entry = ([0] * (len(self.buckets) + 1), [0.0])
+                    self._values[key] = entry
+                for i, n in enumerate(counts):
+                    entry[0][i] += n
+                entry[1][0] += total[0]
+
+# ---------------------------
+# Registry
+# ---------------------------
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def drain(self) -> Dict[str, object]:
+        """Collects and resets counter/histogram values; gauges are process-local and skipped."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: values for m in metrics if (values := m.drain())}
+
+    def merge(self, drained: Dict[str, object]) -> None:
+        with self._lock:
+            metrics = dict(self._metrics)
+        for name, values in drained.items():
+            if name in metrics:
+                metrics[name].merge(values)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# ---------------------------
+# Application metrics
+# ---------------------------
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests by route template, method and status.",
+    ("method", "route", "status"),
+))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.",
+    ("method", "route"),
+))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served.",
+    ("method", "route"),
+))
+LOCK_WAIT = REGISTRY.register(Histogram(
+    "lock_wait_seconds", "Time spent waiting to acquire a shared lock.", ("lock",),
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0),
+))
+LOCK_HOLD = REGISTRY.register(Histogram(
+    "lock_hold_seconds", "Time a shared lock was held.", ("lock",),
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0),
+))
+PHASE_SECONDS = REGISTRY.register(Histogram(
+    "analytics_phase_seconds", "Time spent per phase of an analytics operation.",
+    ("operation", "phase"),
+))
+ROWS_SCANNED = REGISTRY.register(Counter(
+    "analytics_rows_scanned_total", "Rows read from transaction datasets.", ("operation",),
+))
+ROWS_IN_WINDOW = REGISTRY.register(Counter(
+    "analytics_rows_in_window_total", "Rows that fell inside the requested time window.", ("operation",),
+))
+ROWS_REREAD = REGISTRY.register(Counter(
+    "analytics_rows_reread_total", "Rows read again from files already counted (incremental window edges).", ("operation",),
+))
+BYTES_READ = REGISTRY.register(Counter(
+    "analytics_bytes_read_total", "Bytes read from disk (compressed size for .gz).", ("operation",),
+))
+SPILL_BYTES = REGISTRY.register(Counter(
+    "analytics_spill_bytes_total", "Bytes spilled to temporary files by single-pass stream mode.", ("operation",),
+))
+PARTITIONS_SCANNED = REGISTRY.register(Counter(
+    "analytics_partitions_scanned_total", "Dataset partitions (files) read.", ("operation",),
+))
+PARTITIONS_PRUNED = REGISTRY.register(Counter(
+    "analytics_partitions_pruned_total", "Dataset partitions skipped because their range misses the window.", ("operation",),
+))
+INCREMENTAL_REFRESHES = REGISTRY.register(Counter(
+    "analytics_incremental_refresh_total",
+    "Incremental count refreshes by outcome (miss, shared, unchanged, append, rebuild, skipped, over_budget).", ("operation", "outcome"),
+))
+DATASET_ROWS_WRITTEN = REGISTRY.register(Counter(
+    "dataset_rows_written_total", "Rows written by the dataset generator.",
+))
+DATASET_BYTES_WRITTEN = REGISTRY.register(Counter(
+    "dataset_bytes_written_total", "Bytes written by the dataset generator.",
+))
+ADMISSION_ACTIVE = REGISTRY.register(Gauge(
+    "admission_active", "Heavy requests currently executing.", ("endpoint",),
+))
+ADMISSION_QUEUED = REGISTRY.register(Gauge(
+    "admission_queued", "Heavy requests waiting for an execution slot.", ("endpoint",),
+))
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    "admission_rejected_total", "Heavy requests rejected by admission control.", ("endpoint", "reason"),
+))
+
+def record_phases(operation: str, phase_seconds: Dict[str, float]) -> None:
+    """Records one observation per phase for a finished operation."""
+    for phase, seconds in phase_seconds.items():
+        PHASE_SECONDS.observe(operation, phase, value=seconds)
+
+# ---------------------------
+# Instrumented primitives
+# ---------------------------
+class TimedLock:
+    """
+    Context manager around a Lock/RLock that reports wait and hold times.
+    Only the outermost acquisition of a re-entrant lock is measured.
+    """
+
+    def __init__(self, lock, name: str):
+        self._lock = lock
+        self._name = name
+        self._depth = 0
+        self._acquired_at = 0.0
+
+    def __enter__(self):
+        t0 = time.perf_counter()
+        self._lock.acquire()
+        if self._depth == 0:
+            self._acquired_at = time.perf_counter()
+            LOCK_WAIT.observe(self._name, value=self._acquired_at - t0)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            LOCK_HOLD.observe(self._name, value=time.perf_counter() - self._acquired_at)
+        self._lock.release()
+        return False
+
+def _route_template(scope) -> str:
+    """Resolves the route template for a request without running the endpoint."""
+    app = scope.get("app")
+    router = getattr(app, "router", None)
+    for route in getattr(router, "routes", ()):
+        match, _ = route.matches(scope)
+        if match is Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route request counts, latency and in-flight
+    requests. Routes are labelled by their template (``/transit/routes/{route_id}``)
+    so path parameters do not blow up label cardinality.
+    """
+
+    def __init__(self, app, exclude: Iterable[str] = ("/metrics",)):
+        self.app = app
+        self.exclude = frozenset(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = _route_template(scope)
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(method, route)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_LATENCY.observe(method, route, value=time.perf_counter() - t0)
+            HTTP_IN_FLIGHT.dec(method, route)
+            HTTP_REQUESTS.inc(method, route, str(status_holder[0]))
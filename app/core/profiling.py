@@ -0,0 +1,227 @@
+"""
+On-demand profiling with a low-overhead stack sampler.
+
+Output is in collapsed-stack format ("frame;frame;frame count" per line), which
+flamegraph.pl, speedscope and inferno read directly. Everything here is inert
+unless settings.profiling_enabled is true.
+"""
+from __future__ import annotations
+import os, socket, sys, threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Optional, Tuple, TypeVar
+from urllib.parse import parse_qs
+
+from app.core.config import settings
+
+T = TypeVar("T")
+CONTENT_TYPE_COLLAPSED = "text/plain; charset=utf-8"
+
+# ---------------------------
+# Sampler
+# ---------------------------
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()  # root first
+    return ";".join(labels)
+
+class StackSampler:
+    """
+    Samples Python stacks every `interval` seconds from a background thread.
+    With `thread_ids` only those threads are sampled; otherwise every thread
+    except the sampler itself and `exclude_ids`, prefixed with the thread name.
+    """
+
+    def __init__(
+        self, interval: float = 0.005, thread_ids: Optional[Iterable[int]] = None, exclude_ids: Iterable[int] = (),
+    ):
+        self.interval = interval
+        self.thread_ids = frozenset(thread_ids) if thread_ids is not None else None
+        self.exclude_ids = frozenset(exclude_ids)
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()} if self.thread_ids is None else {}
+            for tid, frame in sys._current_frames().items():
+                if tid == own or tid in self.exclude_ids or (self.thread_ids is not None and tid not in self.thread_ids):
+                    continue
+                stack = _collapse(frame)
+                if self.thread_ids is None:
+                    stack = f"{names.get(tid, tid)};{stack}"
+                self.samples[stack] += 1
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> "StackSampler":
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+def sample_process(seconds: float, interval: Optional[float] = None) -> str:
+    """Samples every thread of the live process for `seconds` and returns collapsed stacks."""
+    sampler = StackSampler(interval or settings.profiling_interval).start()
+    try:
+        threading.Event().wait(seconds)
+    finally:
+        sampler.stop()
+    return sampler.collapsed()
+
+def prefix_collapsed(parts: Dict[str, str]) -> str:
+    """Merges collapsed outputs, prefixing each stack with its source (e.g. "web-123", "worker-456")."""
+    return "".join(
+        f"{source};{line}\n" for source, collapsed in parts.items() for line in collapsed.splitlines() if line
+    )
+
+# ---------------------------
+# Live sampling of other processes (pool workers)
+# ---------------------------
+# Each worker listens on <control_dir>/<pid>.sock. A request is one line
+# "<seconds> <interval>"; the reply is the worker's collapsed stacks.
+_SOCKET_SUFFIX = ".sock"
+
+def _serve_sampling(server: socket.socket) -> None:
+    own = threading.get_ident()
+    while True:
+        conn, _ = server.accept()
+        with conn:
+            try:
+                seconds, interval = (float(v) for v in conn.makefile("r").readline().split())
+                sampler = StackSampler(interval, exclude_ids=[own]).start()
+                threading.Event().wait(min(seconds, settings.profiling_max_seconds))
+                conn.sendall(sampler.stop().collapsed().encode("utf-8"))
+            except (OSError, ValueError):
+                continue  # client gone or bad request: keep serving
+
+def serve_sampling(control_dir: str) -> None:
+    """Starts the sampling listener of this process (a daemon thread blocked in accept())."""
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(os.path.join(control_dir, f"{os.getpid()}{_SOCKET_SUFFIX}"))
+    server.listen()
+    threading.Thread(target=_serve_sampling, args=(server,), name="sampling-listener", daemon=True).start()
+
+def _request_samples(path: str, seconds: float, interval: float) -> Optional[str]:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(seconds + 10)
+            sock.connect(path)
+            sock.sendall(f"{seconds} {interval}\n".encode())
+            chunks = []
+            while chunk := sock.recv(65536):
+                chunks.append(chunk)
+    except (ConnectionRefusedError, FileNotFoundError):
+        # Listener of a worker that has exited
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        return None
+    except OSError:
+        return None
+    return b"".join(chunks).decode("utf-8")
+
+def sample_listeners(control_dir: str, seconds: float, interval: Optional[float] = None) -> Dict[int, str]:
+    """Samples every process listening in control_dir at once; returns collapsed stacks by pid."""
+    interval = interval or settings.profiling_interval
+    try:
+        names = [n for n in os.listdir(control_dir) if n.endswith(_SOCKET_SUFFIX)]
+    except FileNotFoundError:
+        return {}
+    if not names:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(names)) as pool:
+        results = pool.map(lambda n: _request_samples(os.path.join(control_dir, n), seconds, interval), names)
+        return {int(n[:-len(_SOCKET_SUFFIX)]): r for n, r in zip(names, results) if r is not None}
+
+# ---------------------------
+# Per-request profiling
+# ---------------------------
+@dataclass
+class RequestProfile:
+    stacks: Optional[str] = None
+
+_current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+
+def current_profile() -> Optional[RequestProfile]:
+    """Returns the RequestProfile of the current request, or None if it was not asked for."""
+    return _current_profile.get()
+
+def run_sampled(func: Callable[..., T], *args, interval: Optional[float] = None, **kwargs) -> Tuple[T, str]:
+    """Runs func under a sampler bound to the calling thread; returns (result, collapsed stacks)."""
+    sampler = StackSampler(interval or settings.profiling_interval, thread_ids=[threading.get_ident()]).start()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        sampler.stop()
+    return result, sampler.collapsed()
+
+def _profile_requested(scope) -> bool:
+    for name, value in scope.get("headers", ()):
+        if name == b"x-profile":
+            return value.strip().lower() in (b"1", b"true", b"yes")
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return query.get("profile", [""])[-1].lower() in ("1", "true", "yes")
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware: when profiling is enabled and a request carries
+    `X-Profile: 1` or `?profile=1`, the handler runs under the sampler and the
+    response body is replaced by its collapsed stacks. The original status is
+    kept in the `X-Profile-Original-Status` header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.profiling_enabled or not _profile_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        messages = []
+
+        async def buffer(message):
+            messages.append(message)
+
+        try:
+            await self.app(scope, receive, buffer)
+        finally:
+            _current_profile.reset(token)
+
+        if profile.stacks is None:
+            # Endpoint is not instrumented: return the normal response untouched
+            for message in messages:
+                await send(message)
+            return
+
+        original_status = next((m["status"] for m in messages if m["type"] == "http.response.start"), 500)
+        body = profile.stacks.encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", CONTENT_TYPE_COLLAPSED.encode()),
+                (b"content-length", str(len(body)).encode()),
+                (b"x-profile-original-status", str(original_status).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
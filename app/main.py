@@ -1,9 +1,54 @@
-from fastapi import FastAPI
+import asyncio, os
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from app.api.v1.routes import router as v1_router
+from app.core.config import settings
+from app.core.executor import Overloaded, prewarm, sample_pool, shutdown_pool
+from app.core.metrics import CONTENT_TYPE_LATEST, REGISTRY, MetricsMiddleware
+from app.core.profiling import CONTENT_TYPE_COLLAPSED, ProfilingMiddleware, prefix_collapsed, sample_process
 
-app = FastAPI(title="Tech Lead Challenge")
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Heavy subsystems load in the worker pool, not at import time
+    if settings.prewarm_on_startup:
+        await run_in_threadpool(prewarm)
+    yield
+    shutdown_pool()
+
+app = FastAPI(title="Tech Lead Challenge", lifespan=lifespan)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
 app.include_router(v1_router, prefix="/api/v1")
 
+@app.exception_handler(Overloaded)
+async def overloaded_handler(_: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/debug/profile", include_in_schema=False)
+async def debug_profile(seconds: float = Query(default=5.0, gt=0), interval: Optional[float] = Query(default=None, gt=0)):
+    if not settings.profiling_enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if seconds > settings.profiling_max_seconds:
+        raise HTTPException(status_code=400, detail=f"seconds must be <= {settings.profiling_max_seconds}")
+    # The web process and every pool worker are sampled over the same period
+    web, workers = await asyncio.gather(
+        run_in_threadpool(sample_process, seconds, interval),
+        run_in_threadpool(sample_pool, seconds, interval),
+    )
+    parts = {f"web-{os.getpid()}": web, **{f"worker-{pid}": stacks for pid, stacks in workers.items()}}
+    return Response(content=prefix_collapsed(parts), media_type=CONTENT_TYPE_COLLAPSED)
@@ -4,6 +4,7 @@ from typing import List, Optional
 from pydantic import BaseModel, Field, model_validator
 
 class TopCustomersRequest(BaseModel):
+    # A file, a directory of date-partitioned files, or a glob
     path: str = Field(default="/app/data/transactions.csv.gz")
     # Use ONE: days  ó  (start & end)
     days: Optional[int] = Field(default=7, ge=1)
@@ -30,3 +31,5 @@ class TopCustomersResponse(BaseModel):
     top_customers: int
     mode: str
     results: List[TopCustomerItem]
+    partitions_scanned: int = 1
+    partitions_pruned: int = 0
@@ -1,22 +1,38 @@
 from __future__ import annotations
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
+from typing import BinaryIO, Optional, Tuple
 
 from app.schemas.analytics import (
     TopCustomersRequest, TopCustomersResponse, TopCustomerItem
 )
+from app.algorithms.compact_counts import CompactCounter
+from app.algorithms.incremental import IncrementalCounts
+from app.algorithms.partitions import discover_partitions, prune_partitions
 from app.algorithms.top_customers import (
-    iter_csv_transactions, top_k_exact, top_k_from_file_two_pass
+    ScanStats, iter_csv_stream_batches, top_k_exact_compact, top_k_exact_partitions,
+    top_k_stream_partitions, top_k_stream_single_pass,
 )
+from app.core import metrics
+from app.core.config import settings
 
-def top_customers_service(req: TopCustomersRequest) -> TopCustomersResponse:
-    """
-    Computes the top customers based on the transactions dataset.
-    Args:
-        req: TopCustomersRequest
-    Returns:
-        TopCustomersResponse
-    """
+_OPERATION = "top_customers"
+# Sealed partitions are scanned: state only pays off for files that keep growing
+_incremental = IncrementalCounts(
+    settings.incremental_cache_entries, settings.incremental_bucket_seconds, settings.incremental_cache_bytes,
+    only_growing=True,
+)
+
+def _count_incremental(path: Path, start_timestamp: int, end_timestamp: int) -> Optional[Tuple[CompactCounter, ScanStats]]:
+    stats = ScanStats()
+    counter, outcome = _incremental.count(path, start_timestamp, end_timestamp, stats, settings.incremental_state_dir)
+    metrics.INCREMENTAL_REFRESHES.inc(_OPERATION, outcome)
+    if counter is None:
+        _record(stats)  # an aborted build still read the file
+        return None
+    return counter, stats
+
+def _window(req: TopCustomersRequest) -> Tuple[int, int]:
     # Temporal window -> epoch
     if req.days is not None:
         end_datetime_utc = datetime.now(timezone.utc)
@@ -26,28 +42,81 @@ def top_customers_service(req: TopCustomersRequest) -> TopCustomersResponse:
         end_datetime_utc = req.end
         if start_datetime_utc.tzinfo is None: start_datetime_utc = start_datetime_utc.replace(tzinfo=timezone.utc)
         if end_datetime_utc.tzinfo is None:   end_datetime_utc = end_datetime_utc.replace(tzinfo=timezone.utc)
+    return int(start_datetime_utc.timestamp()), int(end_datetime_utc.timestamp())
 
-    start_timestamp = int(start_datetime_utc.timestamp())
-    end_timestamp = int(end_datetime_utc.timestamp())
-    path = Path(req.path)
+def _record(stats: ScanStats) -> None:
+    metrics.record_phases(_OPERATION, stats.phase_seconds)
+    metrics.ROWS_SCANNED.inc(_OPERATION, amount=stats.rows_scanned)
+    metrics.ROWS_IN_WINDOW.inc(_OPERATION, amount=stats.rows_in_window)
+    metrics.ROWS_REREAD.inc(_OPERATION, amount=stats.rows_reread)
+    metrics.BYTES_READ.inc(_OPERATION, amount=stats.bytes_read)
+    metrics.SPILL_BYTES.inc(_OPERATION, amount=stats.spill_bytes)
 
-    if req.mode == "exact":
-        pairs = top_k_exact(iter_csv_transactions(path), start_timestamp, end_timestamp, req.top_customers)
-        used = "exact"
-    elif req.mode == "stream":
-        pairs = top_k_from_file_two_pass(path, start_timestamp, end_timestamp, req.top_customers, req.capacity)
-        used = "stream"
+def top_customers_service(req: TopCustomersRequest) -> TopCustomersResponse:
+    """
+    Computes the top customers based on the transactions dataset.
+    Args:
+        req: TopCustomersRequest
+    Returns:
+        TopCustomersResponse
+    """
+    start_timestamp, end_timestamp = _window(req)
+    # A file, or the partitions of a directory/glob that can overlap the window
+    partitions = discover_partitions(req.path)
+    selected = prune_partitions(partitions, start_timestamp, end_timestamp)
+    paths = [p.path for p in selected]
+    stats = ScanStats()
+    workers = settings.partition_read_workers
+
+    mode = req.mode
+    if mode == "auto":
+        # Simple heuristic by size of the data to scan
+        size = sum(p.stat().st_size for p in paths)
+        mode = "stream" if size > 300 * 1024 * 1024 else "exact"
+    if mode == "exact":
+        # Incremental state is bucketed by time, so explicit and rolling (`days`) windows share it
+        count_partition = _count_incremental if settings.incremental_enabled else None
+        pairs = top_k_exact_partitions(
+            paths, start_timestamp, end_timestamp, req.top_customers, stats, workers, count_partition
+        )
+    else:
+        pairs = top_k_stream_partitions(paths, start_timestamp, end_timestamp, req.top_customers, req.capacity, stats, workers)
+    used = mode
+
+    _record(stats)
+    metrics.PARTITIONS_SCANNED.inc(_OPERATION, amount=len(selected))
+    metrics.PARTITIONS_PRUNED.inc(_OPERATION, amount=len(partitions) - len(selected))
+
+    items = [TopCustomerItem(customer_id=cid, count=cnt) for cid, cnt in pairs]
+    return TopCustomersResponse(
+        start_timestamp=start_timestamp, end_timestamp=end_timestamp, top_customers=req.top_customers, mode=used, results=items,
+        partitions_scanned=len(selected), partitions_pruned=len(partitions) - len(selected),
+    )
+
+def top_customers_upload_service(stream: BinaryIO, req: TopCustomersRequest) -> TopCustomersResponse:
+    """
+    Top customers over an uploaded CSV / CSV.GZ stream, read exactly once
+    (req.path is ignored). The size is unknown up front, so `auto` means the
+    bounded-memory single-pass stream mode.
+    Args:
+        stream: binary stream with the transactions
+        req: TopCustomersRequest
+    Returns:
+        TopCustomersResponse
+    """
+    start_timestamp, end_timestamp = _window(req)
+    stats = ScanStats()
+    batches = iter_csv_stream_batches(stream, stats)
+    mode = "stream" if req.mode == "auto" else req.mode
+    if mode == "exact":
+        pairs = top_k_exact_compact(batches, start_timestamp, end_timestamp, req.top_customers, stats)
     else:
-        # Simple heuristic by file size
-        size = path.stat().st_size if path.exists() else 0
-        if size > 300 * 1024 * 1024:
-            pairs = top_k_from_file_two_pass(path, start_timestamp, end_timestamp, req.top_customers, req.capacity)
-            used = "stream"
-        else:
-            pairs = top_k_exact(iter_csv_transactions(path), start_timestamp, end_timestamp, req.top_customers)
-            used = "exact"
+        pairs = top_k_stream_single_pass(
+            batches, start_timestamp, end_timestamp, req.top_customers, req.capacity, stats, settings.stream_spill_dir
+        )
+    _record(stats)
 
     items = [TopCustomerItem(customer_id=cid, count=cnt) for cid, cnt in pairs]
     return TopCustomersResponse(
-        start_timestamp=start_timestamp, end_timestamp=end_timestamp, top_customers=req.top_customers, mode=used, results=items
+        start_timestamp=start_timestamp, end_timestamp=end_timestamp, top_customers=req.top_customers, mode=mode, results=items,
     )
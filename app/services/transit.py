@@ -4,9 +4,10 @@ Services for managing transit routes and stops.
 from threading import RLock
 from typing import Iterable, List
 from app.algorithms.transit_routes import TransitIndex
+from app.core.metrics import TimedLock
 
 _index = TransitIndex()
-_lock = RLock()
+_lock = TimedLock(RLock(), "transit")
 
 def create_route(route_id: str, stops: Iterable[str]) -> None:
     """Returns True if the route was created, False if it already existed."""
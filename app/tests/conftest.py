@@ -1,7 +1,10 @@
 import pytest
 from fastapi.testclient import TestClient
+from app.core.executor import shutdown_pool
 from app.main import app
 
 @pytest.fixture(scope="session")
 def client():
-    return TestClient(app)
+    yield TestClient(app)
+    # Without the lifespan the pool is started lazily and never stopped: stop it (and remove its temp dirs)
+    shutdown_pool()
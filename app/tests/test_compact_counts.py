@@ -0,0 +1,47 @@
+import random
+from app.algorithms.compact_counts import CompactCounter
+from app.algorithms.top_customers import top_k_exact, top_k_exact_compact
+
+def _batches(rows, size):
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+def test_compact_matches_exact_including_ties():
+    random.seed(7)
+    ids = [f"C{random.randrange(300):06d}" for _ in range(5000)]
+    # IDs outside the fixed format are interned
+    ids += random.choices(["vip-1", "C12", "C0000001", "D000001", "ñandú"], k=400)
+    random.shuffle(ids)
+    rows = [(ts, cid, 100) for ts, cid in enumerate(ids)]
+    for k in (1, 5, 50, 1000):
+        expected = top_k_exact(rows, 100, 4900, k)
+        assert top_k_exact_compact(_batches(rows, 256), 100, 4900, k) == expected
+
+def test_compact_counter_arbitrary_ids():
+    c = CompactCounter()
+    c.update(["u1", "u2", "u1", "x", "u3", "x"])
+    c.update(["u2", "x"])
+    assert c.most_common(2) == [("x", 3), ("u1", 2)]
+    assert len(c) == 4
+    assert CompactCounter().most_common(3) == []
+
+def test_sparse_ids_do_not_size_arrays_by_largest_id():
+    import tracemalloc
+    CompactCounter().update(["C000001"])  # warm up numpy before measuring
+    tracemalloc.start()
+    c = CompactCounter()
+    c.update(["C12345678", "C00000001"])
+    c.update([f"C{i * 9_999_991:09d}" for i in range(100)])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < 4 * 2**20
+    assert c.nbytes < 2**20
+    assert c.most_common(2) == [("C12345678", 1), ("C00000001", 1)]
+
+def test_format_is_learned_after_odd_first_id():
+    c = CompactCounter()
+    c.update(["C12"])
+    c.update([f"C{i:06d}" for i in range(1000)] + ["C000123"])
+    assert ("C", 6) in {(f.prefix, f.width) for f in c.formats}
+    assert list(c.intern_index) == ["C12"]
+    assert c.most_common(2) == [("C000123", 2), ("C12", 1)]
+    assert len(c) == 1001
@@ -0,0 +1,46 @@
+import asyncio
+import pytest
+from app.core import executor
+from app.core.executor import AdmissionLimiter, Overloaded
+
+def test_admission_limiter_queue_and_reject():
+    async def scenario():
+        limiter = AdmissionLimiter("demo", max_concurrency=1, max_queue=1, queue_timeout=1.0, retry_after=3)
+        await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as exc:
+            await limiter.acquire()
+        assert exc.value.status_code == 429 and exc.value.retry_after == 3
+        limiter.release()  # slot handed to the queued request
+        await queued
+        assert limiter.active == 1
+        limiter.release()
+        assert limiter.active == 0
+    asyncio.run(scenario())
+
+def test_admission_limiter_queue_timeout():
+    async def scenario():
+        limiter = AdmissionLimiter("demo", max_concurrency=1, max_queue=1, queue_timeout=0.01, retry_after=1)
+        await limiter.acquire()
+        with pytest.raises(Overloaded) as exc:
+            await limiter.acquire()
+        assert exc.value.status_code == 503
+        limiter.release()
+        assert limiter.active == 0
+    asyncio.run(scenario())
+
+def test_pool_slots_bound_requests_admitted_by_endpoints(client, monkeypatch):
+    # The endpoint admits the request, but every pool slot is taken: it times out in the shared queue
+    busy = AdmissionLimiter(executor.POOL_LIMITER, max_concurrency=0, max_queue=1, queue_timeout=0.05, retry_after=4)
+    monkeypatch.setitem(executor._limiters, executor.POOL_LIMITER, busy)
+    res = client.post("/api/v1/analytics/top-customers", json={"path": "/nonexistent.csv.gz"})
+    assert res.status_code == 503
+    assert res.headers["retry-after"] == "4"
+
+def test_heavy_endpoint_rejects_fast_when_saturated(client, monkeypatch):
+    full = AdmissionLimiter("top_customers", max_concurrency=0, max_queue=0, queue_timeout=1.0, retry_after=7)
+    monkeypatch.setitem(executor._limiters, "top_customers", full)
+    res = client.post("/api/v1/analytics/top-customers", json={"path": "/nonexistent.csv.gz"})
+    assert res.status_code == 429
+    assert res.headers["retry-after"] == "7"
@@ -0,0 +1,238 @@
+import csv, gzip, os, random, time
+from app.algorithms import incremental
+from app.algorithms.incremental import IncrementalCounts
+from app.algorithms.top_customers import ScanStats, iter_csv_transactions, top_k_exact
+
+def _rows(n, seed):
+    rnd = random.Random(seed)
+    return [(rnd.randrange(1000), f"C{rnd.randrange(40):06d}", 1) for _ in range(n)]
+
+def _write(path, rows, mode="w"):
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, mode + "t", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        if mode == "w":
+            w.writerow(["timestamp", "customer_id", "amount"])
+        w.writerows(rows)
+
+def _refresh(cache, path, start=100, end=899, **kwargs):
+    stats = ScanStats()
+    counter, outcome = cache.count(path, start, end, stats, **kwargs)
+    return counter.most_common(5), outcome, stats.rows_scanned
+
+def _settle(path):
+    """Backdates the file's mtime so it counts as at rest."""
+    past = time.time_ns() - (incremental.AT_REST_SECONDS + 1) * 10**9
+    os.utime(path, ns=(past, past))
+
+def _expected(path, start=100, end=899, k=5):
+    return top_k_exact(iter_csv_transactions(path), start, end, k)
+
+def test_append_reads_only_the_tail(tmp_path):
+    for name in ("tx.csv", "tx.csv.gz"):
+        path = tmp_path / name
+        cache = IncrementalCounts(bucket_seconds=100)  # windows below cover whole buckets
+        _write(path, _rows(3000, 1))
+        assert _refresh(cache, path) == (_expected(path), "miss", 3000)
+        assert _refresh(cache, path)[1:] == ("unchanged", 0)
+
+        _write(path, _rows(500, 2), mode="a")  # for .gz: a new gzip member
+        assert _refresh(cache, path) == (_expected(path), "append", 500)
+
+def test_last_line_without_newline_is_counted(tmp_path):
+    path = tmp_path / "tx.csv"
+    path.write_text("timestamp,customer_id,amount\n1,A,1\n2,B,1\n3,B,1")
+    _settle(path)
+    counter, _ = IncrementalCounts().count(path, 0, 10)
+    assert counter.most_common(5) == [("B", 2), ("A", 1)]
+
+def test_trailing_line_is_replaced_when_extended(tmp_path):
+    path = tmp_path / "tx.csv"
+    cache = IncrementalCounts(bucket_seconds=100)  # windows below cover whole buckets
+    _write(path, [(150, "C000001", 1)])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("160,C000002,1")
+    _settle(path)
+    top, _, scanned = _refresh(cache, path)
+    assert top == [("C000001", 1), ("C000002", 1)] and scanned == 1
+    assert _refresh(cache, path)[0] == top  # unchanged file: same provisional row
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("0\n170,C000001,1\n180,C0000")  # completes the row; the new last line does not parse yet
+    top, outcome, scanned = _refresh(cache, path)
+    assert outcome == "append" and scanned == 2
+    assert top == [("C000001", 2), ("C000002", 1)]
+
+def test_trailing_line_waits_until_the_file_is_at_rest(tmp_path, monkeypatch):
+    path = tmp_path / "tx.csv"
+    path.write_text("timestamp,amount,customer_id\n725,1,C000012\n726,1,C0000")  # cut inside the last column
+    cache = IncrementalCounts()
+    assert _refresh(cache, path)[0] == [("C000012", 1)]
+    monkeypatch.setattr(incremental, "AT_REST_SECONDS", 0)  # the writer never came back: the line is final
+    assert _refresh(cache, path)[:2] == ([("C000012", 1), ("C0000", 1)], "unchanged")
+
+def test_truncate_or_rewrite_triggers_rebuild(tmp_path):
+    path = tmp_path / "tx.csv"
+    cache = IncrementalCounts(bucket_seconds=100)  # windows below cover whole buckets
+    _write(path, _rows(2000, 3))
+    _refresh(cache, path)
+
+    _write(path, _rows(100, 4))  # truncated
+    assert _refresh(cache, path) == (_expected(path), "rebuild", 100)
+
+    stat = os.stat(path)
+    data = path.read_bytes().replace(b"C0000", b"C0001")  # same size, new content
+    path.write_bytes(data)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert _refresh(cache, path) == (_expected(path), "rebuild", 100)
+
+    _write(path, _rows(10, 5), mode="a")
+    path.write_bytes(path.read_bytes().replace(b"C0001", b"C0002", 1))  # edited while growing
+    assert _refresh(cache, path) == (_expected(path), "rebuild", 110)
+
+def test_service_reuses_counts_for_explicit_window(tmp_path):
+    from app.schemas.analytics import TopCustomersRequest
+    from app.services import analytics
+    path = tmp_path / "tx.csv"
+    _write(path, _rows(200, 6))
+    req = TopCustomersRequest(
+        path=str(path), days=None, mode="exact", top_customers=5,
+        start="1970-01-01T00:01:40Z", end="1970-01-01T00:14:59Z",
+    )
+    analytics._incremental.clear()
+    first = analytics.top_customers_service(req)
+    _write(path, _rows(50, 7), mode="a")
+    second = analytics.top_customers_service(req)
+    assert [(r.customer_id, r.count) for r in second.results] == _expected(path)
+    assert sum(r.count for r in second.results) >= sum(r.count for r in first.results)
+    entry = analytics._incremental._entries[str(path.resolve())]
+    assert entry.counts.cursor.offset == path.stat().st_size
+
+def test_any_window_matches_full_scan(tmp_path, monkeypatch):
+    # Small reads: many chunks to re-read at the window edges, and gzip checkpoints inside members
+    monkeypatch.setattr(incremental, "READ_CHUNK", 512)
+    monkeypatch.setattr(incremental, "GZ_CHECKPOINT_BYTES", 1024)
+    rnd = random.Random(8)
+    for name in ("tx.csv", "tx.csv.gz"):
+        path = tmp_path / name
+        cache = IncrementalCounts(bucket_seconds=60)
+        _write(path, sorted(_rows(1500, 9)) + _rows(300, 10))  # mostly time-ordered, then out of order
+        for step in range(3):
+            if step:
+                _write(path, _rows(200, 10 + step), mode="a")
+            for _ in range(15):
+                start = rnd.randrange(-50, 1000)
+                end = start + rnd.randrange(0, 600)
+                counter, _ = cache.count(path, start, end)
+                assert counter.most_common(8) == _expected(path, start, end, k=8), (name, start, end)
+
+def test_rolling_window_reads_edges_and_tail_only(tmp_path, monkeypatch):
+    monkeypatch.setattr(incremental, "READ_CHUNK", 4096)
+    path = tmp_path / "tx.csv"
+    cache = IncrementalCounts(bucket_seconds=100)
+    _write(path, [(t, f"C{t % 37:06d}", 1) for t in range(0, 20_000, 2)])  # 10000 time-ordered rows
+    assert _refresh(cache, path, 5_050, 15_050)[:2] == (_expected(path, 5_050, 15_050), "miss")
+    stats = ScanStats()
+    counter, outcome = cache.count(path, 5_070, 15_070, stats)  # the window moved: only its 2 cut buckets are read
+    assert outcome == "unchanged" and counter.most_common(5) == _expected(path, 5_070, 15_070)
+    assert stats.rows_scanned == 0 and 0 < stats.rows_reread < 1_000
+    _write(path, [(20_000, "C000001", 1)], mode="a")
+    top, outcome, scanned = _refresh(cache, path, 10_000, 20_099)
+    assert outcome == "append" and top == _expected(path, 10_000, 20_099) and scanned == 1
+
+def test_stats_report_rows_in_window_and_reread_separately(tmp_path, monkeypatch):
+    monkeypatch.setattr(incremental, "READ_CHUNK", 4096)
+    path = tmp_path / "tx.csv"
+    rows = sorted(_rows(12_000, 12))
+    _write(path, rows)
+    cache = IncrementalCounts(bucket_seconds=100)
+    for start, end, scanned in ((100, 850, 12_000), (100, 850, 0), (101, 851, 0)):
+        stats = ScanStats()
+        cache.count(path, start, end, stats)
+        assert stats.rows_in_window == sum(start <= ts <= end for ts, _, _ in rows)
+        assert stats.rows_scanned == scanned
+    assert 0 < stats.rows_reread < 12_000  # the shifted window re-read its two cut buckets
+
+def test_state_is_shared_between_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(incremental, "SHARE_MIN_BYTES", 0)
+    state_dir = tmp_path / "state"
+    state_dir.mkdir()
+    for name in ("tx.csv", "tx.csv.gz"):
+        path = tmp_path / name
+        _write(path, _rows(3000, 1))
+        first, second = IncrementalCounts(bucket_seconds=100), IncrementalCounts(bucket_seconds=100)
+        assert _refresh(first, path, state_dir=str(state_dir)) == (_expected(path), "miss", 3000)
+        assert _refresh(second, path, state_dir=str(state_dir)) == (_expected(path), "shared", 0)
+        _write(path, _rows(500, 2), mode="a")
+        assert _refresh(second, path, state_dir=str(state_dir)) == (_expected(path), "append", 500)
+        assert _refresh(first, path, state_dir=str(state_dir)) == (_expected(path), "shared", 0)
+
+def test_only_files_seen_growing_are_cached(tmp_path):
+    path = tmp_path / "tx.csv"
+    _write(path, _rows(300, 13))
+    cache = IncrementalCounts(bucket_seconds=100, only_growing=True)
+    assert cache.count(path, 100, 899) == (None, "skipped")
+    assert cache.count(path, 100, 899) == (None, "skipped")  # sealed: never cached
+    _write(path, _rows(20, 14), mode="a")
+    assert _refresh(cache, path) == (_expected(path), "miss", 320)
+    _write(path, _rows(20, 15), mode="a")
+    assert _refresh(cache, path) == (_expected(path), "append", 20)
+
+def test_cache_and_state_dir_stay_within_byte_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(incremental, "SHARE_MIN_BYTES", 0)
+    monkeypatch.setattr(incremental, "READ_CHUNK", 512)
+    monkeypatch.setattr(incremental, "BUDGET_CHECK_CHUNKS", 1)
+    state_dir = tmp_path / "state"
+    state_dir.mkdir()
+    paths = [tmp_path / f"day{i}.csv" for i in range(3)]
+    for i, path in enumerate(paths):
+        _write(path, _rows(2000, 20 + i))
+    probe = IncrementalCounts(bucket_seconds=100)
+    probe.count(paths[0], 100, 899)
+    one = probe._entries[str(paths[0].resolve())].nbytes
+    cache = IncrementalCounts(bucket_seconds=100, max_bytes=int(one * 1.5))
+    for path in paths:
+        assert _refresh(cache, path, state_dir=str(state_dir))[:2] == (_expected(path), "miss")
+        assert list(cache._entries) == [str(path.resolve())]  # the previous file was evicted
+        assert sum(f.stat().st_size for f in state_dir.glob("*.state")) <= cache.max_bytes
+
+    big = tmp_path / "big.csv"
+    _write(big, _rows(20_000, 30))
+    stats = ScanStats()
+    assert cache.count(big, 100, 899, stats) == (None, "over_budget")
+    assert 0 < stats.rows_scanned < 20_000  # gave up part way through
+    assert cache.count(big, 100, 899) == (None, "skipped")
+
+def test_service_scans_sealed_partitions_and_caches_the_growing_one(tmp_path):
+    from app.schemas.analytics import TopCustomersRequest
+    from app.services import analytics
+    for day in range(3):
+        _write(tmp_path / f"tx_2025-01-0{day + 1}.csv", [(1_735_689_600 + day * 86_400 + i, f"C{i % 7:06d}", 1) for i in range(300)])
+    newest = tmp_path / "tx_2025-01-03.csv"
+    req = TopCustomersRequest(
+        path=str(tmp_path), days=None, mode="exact", top_customers=3,
+        start="2025-01-01T00:00:00Z", end="2025-01-04T00:00:00Z",
+    )
+    analytics._incremental.clear()
+    for i in range(3):
+        resp = analytics.top_customers_service(req)
+        rows = [r for p in sorted(tmp_path.glob("*.csv")) for r in iter_csv_transactions(p)]
+        assert [(r.customer_id, r.count) for r in resp.results] == top_k_exact(rows, resp.start_timestamp, resp.end_timestamp, 3)
+        _write(newest, [(1_735_862_400 + 1000 + i, "C000009", 1)], mode="a")
+    assert list(analytics._incremental._entries) == [str(newest.resolve())]
+
+def test_service_uses_incremental_counts_for_days_window(tmp_path):
+    from app.schemas.analytics import TopCustomersRequest
+    from app.services import analytics
+    now = int(time.time())
+    rnd = random.Random(11)
+    path = tmp_path / "tx.csv"
+    _write(path, sorted((now - rnd.randrange(3 * 86_400), f"C{rnd.randrange(30):06d}", 1) for _ in range(2000)))
+    req = TopCustomersRequest(path=str(path), days=2, mode="exact", top_customers=5)
+    analytics._incremental.clear()
+    for _ in range(2):
+        resp = analytics.top_customers_service(req)
+        expected = top_k_exact(iter_csv_transactions(path), resp.start_timestamp, resp.end_timestamp, 5)
+        assert [(r.customer_id, r.count) for r in resp.results] == expected
+        _write(path, [(now, "C000001", 1)], mode="a")
+    entry = analytics._incremental._entries[str(path.resolve())]
+    assert entry.counts.cursor.rows == 2001
@@ -0,0 +1,45 @@
+import csv, gzip
+from app.algorithms.top_customers import (
+    ScanStats, iter_csv_batches, iter_csv_transactions, top_k_exact, top_k_exact_compact, top_k_exact_partitions,
+)
+from app.core.metrics import Histogram
+
+def _make_small_csv(path):
+    with gzip.open(path, "wt", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["timestamp","customer_id","amount"])
+        for r in [(1,"A",100),(2,"B",100),(3,"A",50),(4,"C",70),(5,"B",20),(6,"A",10)]:
+            w.writerow(r)
+
+def test_histogram_exposition():
+    h = Histogram("demo_seconds", "demo", ("route",), buckets=(0.1, 1.0))
+    h.observe("/x", value=0.05)
+    h.observe("/x", value=0.5)
+    text = "\n".join(h.render())
+    assert 'demo_seconds_bucket{route="/x",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{route="/x",le="+Inf"} 2' in text
+    assert 'demo_seconds_count{route="/x"} 2' in text
+
+def test_batched_scan_matches_exact_and_collects_stats(tmp_path):
+    p = tmp_path/"transactions.csv.gz"
+    _make_small_csv(p)
+    expected = top_k_exact(iter_csv_transactions(p), 2, 6, 2)
+    batched, partitioned = ScanStats(), ScanStats()
+    assert top_k_exact_compact(iter_csv_batches(p, batched, batch_size=4), 2, 6, 2, batched) == expected
+    assert top_k_exact_partitions([p], 2, 6, 2, partitioned) == expected
+    for stats in (batched, partitioned):
+        assert stats.rows_scanned == 6
+        assert stats.rows_in_window == 5
+        assert stats.bytes_read == p.stat().st_size
+        assert set(stats.phase_seconds) == {"parse", "filter", "count", "select"}
+
+def test_metrics_endpoint(client):
+    client.get("/health")
+    client.get("/api/v1/transit/routes/R-metrics/stops")
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+    body = res.text
+    assert 'http_requests_total{method="GET",route="/health",status="200"}' in body
+    assert 'route="/api/v1/transit/routes/{route_id}/stops"' in body
+    assert 'lock_hold_seconds_count{lock="transit"}' in body
@@ -0,0 +1,101 @@
+import csv, gzip, json, random
+from datetime import datetime, timezone
+from app.algorithms.compact_counts import CompactCounter
+from app.algorithms.partitions import discover_partitions, prune_partitions
+from app.algorithms.top_customers import MG, top_k_exact, top_k_exact_partitions, top_k_stream_partitions
+
+DAY = 24 * 60 * 60
+JAN_1 = int(datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp())
+
+def _write(path, rows):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "wt", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["timestamp", "customer_id", "amount"])
+        w.writerows(rows)
+
+def _daily_dataset(root, days=5, per_day=400):
+    random.seed(3)
+    all_rows = []
+    for d in range(days):
+        rows = [(JAN_1 + d * DAY + random.randrange(DAY), f"C{random.randrange(60):06d}", 1) for _ in range(per_day)]
+        _write(root / f"transactions-2025-01-{d + 1:02d}.csv.gz", rows)
+        all_rows += rows
+    return all_rows
+
+def test_discover_and_prune_by_name_and_manifest(tmp_path):
+    _daily_dataset(tmp_path, days=3, per_day=5)
+    _write(tmp_path / "dt=2025-02-10" / "part-0.csv", [])
+    _write(tmp_path / "extra.csv", [])  # unknown range: never pruned
+    parts = discover_partitions(str(tmp_path))
+    assert len(parts) == 5
+    kept = prune_partitions(parts, JAN_1 + DAY + 10, JAN_1 + DAY + 20)
+    assert sorted(p.path.name for p in kept) == ["extra.csv", "transactions-2025-01-02.csv.gz"]
+
+    (tmp_path / "_manifest.json").write_text(json.dumps({"partitions": [
+        {"path": "extra.csv", "min_timestamp": 0, "max_timestamp": 10},
+    ]}))
+    kept = prune_partitions(discover_partitions(str(tmp_path)), JAN_1 + DAY + 10, JAN_1 + DAY + 20)
+    assert [p.path.name for p in kept] == ["transactions-2025-01-02.csv.gz"]
+    assert len(discover_partitions(str(tmp_path / "*-01-0[12].csv.gz"))) == 2
+
+def test_glob_uses_path_below_literal_root_and_nearby_manifests(tmp_path):
+    for d in (1, 2, 3):
+        _write(tmp_path / f"dt=2025-01-{d:02d}" / "part-0.csv", [])
+    _write(tmp_path / "dt=latest" / "part-0.csv", [])
+    (tmp_path / "dt=latest" / "_manifest.json").write_text(json.dumps({"partitions": [
+        {"path": "part-0.csv", "min_timestamp": JAN_1 + 5 * DAY, "max_timestamp": JAN_1 + 6 * DAY},
+    ]}))
+    parts = discover_partitions(str(tmp_path / "dt=*" / "*.csv"))
+    assert all(p.min_timestamp is not None for p in parts)
+    kept = prune_partitions(parts, JAN_1 + DAY + 10, JAN_1 + DAY + 20)
+    assert [p.path.parent.name for p in kept] == ["dt=2025-01-02"]
+    kept = prune_partitions(parts, JAN_1 + 5 * DAY, JAN_1 + 5 * DAY)
+    assert [p.path.parent.name for p in kept] == ["dt=latest"]
+
+def test_partitioned_counts_match_single_pass(tmp_path):
+    rows = _daily_dataset(tmp_path)
+    paths = [p.path for p in discover_partitions(str(tmp_path))]
+    start, end = JAN_1 + DAY // 2, JAN_1 + 4 * DAY
+    expected = top_k_exact(rows, start, end, 5)
+    assert top_k_exact_partitions(paths, start, end, 5, max_workers=3) == expected
+    stream = top_k_stream_partitions(paths, start, end, 5, capacity=100, max_workers=3)
+    assert [c for _, c in stream] == [c for _, c in expected]
+
+def test_compact_counter_merge_matches_concatenation():
+    a_keys = ["C000001", "x", "C000002", "C000001"]
+    for b_keys in (
+        ["C000003", "y", "x", "C000002", "C000003"],  # same fixed format
+        ["u1", "C000003", "x", "u1", "C000002"],      # b learns a different format
+    ):
+        joined, a, b = CompactCounter(), CompactCounter(), CompactCounter()
+        joined.update(a_keys)
+        joined.update(b_keys)
+        a.update(a_keys)
+        b.update(b_keys)
+        a.merge(b)
+        assert a.most_common(10) == joined.most_common(10)
+        assert len(a) == len(joined)
+
+def test_mg_merge_keeps_heavy_hitters():
+    left, right = MG(capacity=3), MG(capacity=3)
+    for key in "aaaabbc":
+        left.offer(key)
+    for key in "aaadde":
+        right.offer(key)
+    left.merge(right)
+    assert "a" in left.counters and len(left.counters) <= 3
+
+def test_endpoint_prunes_daily_partitions(client, tmp_path):
+    rows = _daily_dataset(tmp_path)
+    payload = {
+        "path": str(tmp_path), "days": None, "mode": "exact", "top_customers": 3,
+        "start": "2025-01-03T00:00:00Z", "end": "2025-01-03T23:59:59Z",
+    }
+    res = client.post("/api/v1/analytics/top-customers", json=payload)
+    assert res.status_code == 200
+    data = res.json()
+    assert data["partitions_scanned"] == 1 and data["partitions_pruned"] == 4
+    expected = top_k_exact(rows, data["start_timestamp"], data["end_timestamp"], 3)
+    assert [(r["customer_id"], r["count"]) for r in data["results"]] == expected
@@ -0,0 +1,53 @@
+import csv, gzip
+from app.core.config import settings
+
+def _make_csv(path, rows=50_000):
+    with gzip.open(path, "wt", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["timestamp","customer_id","amount"])
+        for i in range(rows):
+            w.writerow((i, f"C{i % 97:06d}", 100))
+
+def _payload(path):
+    return {"path": str(path), "days": None, "start": "1970-01-01T00:00:00Z",
+            "end": "1970-01-02T00:00:00Z", "top_customers": 3, "mode": "exact"}
+
+def test_profile_ignored_when_disabled(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiling_enabled", False)
+    p = tmp_path/"tx.csv.gz"
+    _make_csv(p, rows=10)
+    res = client.post("/api/v1/analytics/top-customers?profile=1", json=_payload(p))
+    assert res.status_code == 200
+    assert "results" in res.json()
+    assert client.get("/debug/profile", params={"seconds": 0.01}).status_code == 404
+
+def test_profile_request_returns_collapsed_stacks(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "profiling_enabled", True)
+    monkeypatch.setattr(settings, "profiling_interval", 0.001)
+    p = tmp_path/"tx.csv.gz"
+    _make_csv(p)
+    res = client.post("/api/v1/analytics/top-customers", json=_payload(p), headers={"X-Profile": "1"})
+    assert res.status_code == 200
+    assert res.headers["x-profile-original-status"] == "200"
+    assert "top_customers_service" in res.text
+    # collapsed format: "<stack> <count>"
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in res.text.splitlines())
+
+def test_live_process_sampling(client, monkeypatch):
+    monkeypatch.setattr(settings, "profiling_enabled", True)
+    res = client.get("/debug/profile", params={"seconds": 0.05, "interval": 0.005})
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+
+def test_live_sampling_includes_busy_pool_workers(client, monkeypatch):
+    import time
+    from app.core import executor
+    monkeypatch.setattr(settings, "profiling_enabled", True)
+    executor.prewarm()
+    busy = executor.get_pool().submit(executor._run_in_worker, time.sleep, (1.0,), None)
+    res = client.get("/debug/profile", params={"seconds": 0.3, "interval": 0.005})
+    busy.result()
+    assert res.status_code == 200
+    worker_stacks = [line for line in res.text.splitlines() if line.startswith("worker-")]
+    assert any("_run_in_worker (executor.py" in line for line in worker_stacks)
+    assert any(line.startswith("web-") for line in res.text.splitlines())